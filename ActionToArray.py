@@ -5,6 +5,82 @@ import numpy as np
 import chess.variant
 import copy
 
+COLUMN_NAMES = "abcdefgh"
+
+# The action array is 4504 entries long, made of these planes:
+# placedPlane      5 x 8 x 8  pawn, knight, bishop, rook, queen.
+# pickUpPlane      8 x 8
+# movePlane        8 x 7 x 8 x 8  direction (N, NE, E, SE, S, SW, W, NW), squares moved, destination.
+# knightMovePlane  8 x 8 x 8  direction ([1, 2],[2, 1],[2, -1],[1, -2],[-1, -2],[-2, -1],[-2, 1],[-1, 2])
+# underPromotion   3 x 8  knight, bishop, rook, destination column.
+PLACED_OFFSET = 0
+PICKUP_OFFSET = 64 * 5
+MOVE_OFFSET = 64 * 6
+KNIGHT_OFFSET = MOVE_OFFSET + (8 * 7 * 8 * 8)
+UNDERPROMOTION_OFFSET = KNIGHT_OFFSET + (8 * 8 * 8)
+ACTION_ARRAY_LEN = UNDERPROMOTION_OFFSET + (3 * 8)
+
+# (row movement, column movement) of one step in each direction of the movePlane and knightMovePlane.
+QUEEN_DIRECTIONS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+KNIGHT_DIRECTIONS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+
+
+def squareName(directory):
+    return COLUMN_NAMES[directory % 8] + str(8 - directory // 8)
+
+
+# Every move that can appear in a crazyhouse game is given a move id, built once at import.
+# MOVE_INDEX maps the id to the entry of the action array that moveArray sets to 1, and PICKUP_INDEX maps it to
+# the pick-up square (-1 for dropped pieces). The move is identified by its uci string, which already
+# encodes the (from-square, to-square, promotion or drop piece) triple.
+def createMoveTable():
+    moveNames = []
+    moveIndex = []
+    pickUpIndex = []
+
+    def addMove(name, index, pickUp):
+        moveNames.append(name)
+        moveIndex.append(index)
+        pickUpIndex.append(pickUp)
+
+    for directory in range(64):
+        i, j = directory // 8, directory % 8
+
+        # straight and diagonal movement, and queen promotions (which use the same entry as the pawn move).
+        for direction in range(8):
+            rowMovement, columnMovement = QUEEN_DIRECTIONS[direction]
+            for magnitude in range(7):
+                newI, newJ = i - rowMovement * (magnitude + 1), j + columnMovement * (magnitude + 1)
+                if -1 < newI < 8 and -1 < newJ < 8:
+                    target = newI * 8 + newJ
+                    index = MOVE_OFFSET + (((direction * 7) + magnitude) * 64) + target
+                    addMove(squareName(directory) + squareName(target), index, PICKUP_OFFSET + directory)
+                    # white pawns promote from row 1 to 0, black pawns from row 6 to 7.
+                    if magnitude == 0 and ((i == 1 and rowMovement == 1) or (i == 6 and rowMovement == -1)):
+                        addMove(squareName(directory) + squareName(target) + "q", index, PICKUP_OFFSET + directory)
+                        for k in range(3):
+                            addMove(squareName(directory) + squareName(target) + "nbr"[k],
+                                    UNDERPROMOTION_OFFSET + (k * 8) + newJ, PICKUP_OFFSET + directory)
+
+        # knight movement
+        for direction in range(8):
+            rowMovement, columnMovement = KNIGHT_DIRECTIONS[direction]
+            newI, newJ = i - rowMovement, j + columnMovement
+            if -1 < newI < 8 and -1 < newJ < 8:
+                target = newI * 8 + newJ
+                addMove(squareName(directory) + squareName(target), KNIGHT_OFFSET + (direction * 64) + target,
+                        PICKUP_OFFSET + directory)
+
+        # placed pieces
+        for k in range(5):
+            addMove("PNBRQ"[k] + "@" + squareName(directory), PLACED_OFFSET + (k * 64) + directory, -1)
+
+    moveIds = {moveNames[k]: k for k in range(len(moveNames))}
+    return moveNames, moveIds, np.array(moveIndex, dtype=np.int64), np.array(pickUpIndex, dtype=np.int64)
+
+
+MOVE_NAMES, MOVE_IDS, MOVE_INDEX, PICKUP_INDEX = createMoveTable()
+
 def legalMovesFromSquare(directory2, board, pythonChessBoard):
 
     rowNames = "abcdefgh"
@@ -125,7 +201,8 @@ def legalMovesFromSquare(directory2, board, pythonChessBoard):
             # check each square
             finalRow = rowNames[j]
             finalCol = str(8 - i)
-            if possibleMovePlane[i][j] == 1:
+            # the square the piece stands on is never a legal destination (and is not valid uci).
+            if possibleMovePlane[i][j] == 1 and i * 8 + j != directory2:
                 promotionPieces = ["n", "b", "r", "q"]
                 # for white pawn
                 if pieceBeingMoved == "P" and directory2 < 16:  # can be promoted
@@ -159,7 +236,20 @@ def moveablePieces(board, pythonChessBoard):
                 moveablePieces[i][j] = 1
     return moveablePieces
 
+# sort key that reproduces the order legalMovesForStateByProbing finds the moves in: square by square from a8 to h1,
+# first the moves from that square by destination square (promotions as n, b, r, q), then the pieces that can be
+# placed on it (P, N, B, R, Q). python-chess squares count from a1, so the rows are flipped with ^ 56.
+def legalMoveOrder(move):
+    return ((move.from_square ^ 56) * 4096) + ((move.to_square ^ 56) * 8) + (move.promotion or move.drop or 0)
+
+# enumerates pythonChessBoard.legal_moves once. board (the array board) is no longer needed, but kept so that
+# existing callers do not change.
 def legalMovesForState(board, pythonChessBoard):
+    return [move.uci() for move in sorted(pythonChessBoard.legal_moves, key=legalMoveOrder)]
+
+# the original move generator, which builds a possible move plane for each square and checks every candidate
+# against python-chess. Kept as a reference for legalMovesForState.
+def legalMovesForStateByProbing(board, pythonChessBoard):
     legalMoves = []
     for i in range(8):
         for j in range(8):
@@ -191,117 +281,29 @@ def moveablePiecesPenalty(board, pythonChessBoard):
 
 # move is a string, turns into array. pick-up square should have value 2 instead of 1.
 def moveArray(move, board, notArrayToString=True):
-    placedPlane = np.zeros((5, 8, 8))  # pawn, knight, bishop, rook, queen.
-    pickUpPlane = np.zeros((8, 8))
-    movePlane = np.zeros((8, 7, 8, 8))  # direction (N, NE, E, SE, S, SW, W, NW), squares.
-    knightMovePlane = np.zeros((8, 8, 8))  # direction ([1, 2],[2, 1],[2, -1],[1, -2],[-1, -2],[-2, -1],[-2, 1],[-1, 2])
-    underPromotion = np.zeros((3, 8))  # this can be a 8x8 plane, but for now we will not. Knight, Bishop, Rook
-
-    if "PRNBQ".find(move[0]) == -1:
-        #print("MOVE TO ARRAY: NORMAL MOVE")
-        rowNames = "abcdefgh"
-        if notArrayToString:
-            pickUpPlane[8 - int(move[1])][int(rowNames.find(move[0]))] = 2
-
-        # identify how far the piece has moved, and how far it will be moving.
-        if "PBRQK".find(board[8 - int(move[1])][int(rowNames.find(move[0]))].upper()) != -1:
-            # print("its a", board[8 - int(move[1])][int(rowNames.find(move[0]))])
-            if len(move) == 5:
-                directory = "nbr".find(move[4].lower())  # .lower() just in case
-                if directory != -1:
-                    underPromotion[directory][int(rowNames.find(move[2]))] = 1
-                else:
-                    if int(move[3]) == 8: # white queen promotion
-                        columnMovement = int(rowNames.find(move[2])) - int(
-                            rowNames.find(move[0]))  # positive = east, negative = west [EAST = +1, WEST = -1]
-                        if columnMovement == 1:
-                            movePlane[1][0][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-                        if columnMovement == 0:
-                            movePlane[0][0][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-                        if columnMovement == -1:
-                            movePlane[-1][0][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-                    if int(move[3]) == 1: # black queen promotion
-                        columnMovement = int(rowNames.find(move[2])) - int(
-                            rowNames.find(move[0]))  # positive = east, negative = west [EAST = +1, WEST = -1]
-                        if columnMovement == 1:
-                            movePlane[3][0][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-                        if columnMovement == 0:
-                            movePlane[4][0][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-                        if columnMovement == -1:
-                            movePlane[5][0][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-                    # find direction of promotion
-                    # movement is one.
-                    # change the plane
+    moveToArray = np.zeros((1, ACTION_ARRAY_LEN))
+    moveId = MOVE_IDS[move]
+    pickUpIndex = PICKUP_INDEX[moveId]
 
-            else:
-                rowMovement = int(move[3]) - int(move[1])  # positive = north, negative = south [NORTH = 0, SOUTH = 4]
-                columnMovement = int(rowNames.find(move[2])) - int(
-                    rowNames.find(move[0]))  # positive = east, negative = west [EAST = +1, WEST = -1]
-
-                directory = 999
-                if rowMovement > 0:  # NORTH
-                    directory = 0
-                    if columnMovement > 0:  # NORTH-EAST
-                        directory = 1
-                    if columnMovement < 0:  # NORTH-WEST
-                        directory = 7
-                elif rowMovement < 0:
-                    directory = 4
-                    if columnMovement > 0:  # SOUTH-EAST
-                        directory = 3
-                    if columnMovement < 0:  # SOUTH-WEST
-                        directory = 5
-                elif rowMovement == 0:
-                    if columnMovement > 0:  # EAST:
-                        directory = 2
-                    if columnMovement < 0:  # WEST
-                        directory = 6
-
-                magnitude = max(abs(rowMovement), abs(columnMovement)) - 1
-                movePlane[directory][magnitude][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-        elif board[8 - int(move[1])][int(rowNames.find(move[0]))] == " ":
+    if pickUpIndex != -1:
+        if notArrayToString:
+            moveToArray[0, pickUpIndex] = 2
+        if board[8 - int(move[1])][COLUMN_NAMES.find(move[0])] == " ":
             print("not legal move")  # don't do anything
-        else:
-            # print("its a knight")
-            rowMovement = int(move[3]) - int(move[1])  # positive = north, negative = south [NORTH = 0, SOUTH = 4]
-            columnMovement = int(rowNames.find(move[2])) - int(
-                rowNames.find(move[0]))  # positive = east, negative = west [EAST = +1, WEST = -1]
-            directory = 999
-            if rowMovement == 1:
-                if columnMovement == 2:
-                    directory = 0
-                elif columnMovement == -2:
-                    directory = 3
-            elif rowMovement == 2:
-                if columnMovement == 1:
-                    directory = 1
-                elif columnMovement == -1:
-                    directory = 2
-            elif rowMovement == -2:
-                if columnMovement == 1:
-                    directory = 6
-                elif columnMovement == -1:
-                    directory = 5
-            elif rowMovement == -1:
-                if columnMovement == 2:
-                    directory = 7
-                elif columnMovement == -2:
-                    directory = 4
-            knightMovePlane[directory][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-    else:
-        # print("PLACED PIECE")
-        rowNames = "abcdefgh"
-        placedPlane["PNBRQ".find(move[0])][8 - int(move[3])][int(rowNames.find(move[2]))] = 1
-
-    # return the result.
-    placedPlane = placedPlane.flatten()
-    pickUpPlane = pickUpPlane.flatten()
-    movePlane = movePlane.flatten()
-    knightMovePlane = knightMovePlane.flatten()
-    underPromotion = underPromotion.flatten()
-    moveToArray = np.concatenate((placedPlane, pickUpPlane, movePlane, knightMovePlane, underPromotion))
+            return moveToArray
+
+    moveToArray[0, MOVE_INDEX[moveId]] = 1
     # ARRAY IS 4504 ENTRIES LONG
-    return moveToArray.reshape((1, 4504))
+    return moveToArray
+
+# returns the policy index of the placed/moved square of a move (the entry moveArray sets to 1).
+def moveIndex(move):
+    return int(MOVE_INDEX[MOVE_IDS[move]])
+
+# returns the policy indices of a list of moves, plus the pick-up indices (-1 for dropped pieces).
+def moveIndices(moves):
+    moveIds = np.fromiter((MOVE_IDS[move] for move in moves), dtype=np.int64, count=len(moves))
+    return MOVE_INDEX[moveIds], PICKUP_INDEX[moveIds]
 
 def placementPieceAvailable(captivePieces):
     newArray = [0, 0, 0, 0, 0]
@@ -310,6 +312,14 @@ def placementPieceAvailable(captivePieces):
             newArray[i] = 1
     return newArray
 
+# Sparse move arrays: row k holds weights[offsets[k]:offsets[k + 1]] at indices[offsets[k]:offsets[k + 1]].
+# Returns them as dense (N, ACTION_ARRAY_LEN) arrays.
+def denseActions(offsets, indices, weights, dtype=np.float32):
+    actions = np.zeros((len(offsets) - 1, ACTION_ARRAY_LEN), dtype=dtype)
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    np.add.at(actions, (rows, np.asarray(indices, dtype=np.int64)), weights)
+    return actions
+
 # turns array into string! yay
 def moveArrayToString(array, board, pythonChessBoard, whiteCaptivePieces, blackCaptivePieces, plies):
 
@@ -425,13 +435,13 @@ def moveArrayToString(array, board, pythonChessBoard, whiteCaptivePieces, blackC
 
         if len(searchPossibilities) > 0:
             bestMove = searchPossibilities[0]    # need to get the score for the move as well
-            bestMoveScore = array[0][np.argmax(moveArray(searchPossibilities[0], board, False))]
+            bestMoveScore = array[0][moveIndex(searchPossibilities[0])]
             #print(bestMoveScore)
             if len(searchPossibilities) > 1:
                 for i in range(1, len(searchPossibilities)):
                     # find a better move...?
                     newSearch = searchPossibilities[i]
-                    newSearchScore = array[0][np.argmax(moveArray(searchPossibilities[i], board, False))]
+                    newSearchScore = array[0][moveIndex(searchPossibilities[i])]
                     #print(newSearchScore)
                     if newSearchScore > bestMoveScore:
                         bestMove = newSearch
@@ -476,10 +486,22 @@ def moveEvaluation(move, board, prediction):
     return finalEval
 
 def moveEvaluations(legalMoves, board, prediction):
-    evals = np.zeros((len(legalMoves)))
-    for i in range(len(evals)):
-        evals[i] = moveEvaluation(legalMoves[i], board, prediction)
-    return evals
+    return moveEvaluationsBatch(legalMoves, prediction)
+
+# same scores as moveEvaluation for every legal move, but the prediction is converted once and the scores are
+# gathered from the precomputed indices. A normal move scores its moved entry plus twice its pick-up entry, and
+# a placed piece (the only move array that sums to 1) is doubled.
+def moveEvaluationsBatch(legalMoves, prediction, indices=None):
+    if indices is None:
+        indices = moveIndices(legalMoves)
+    moveRows, pickUpRows = indices
+
+    if not isinstance(prediction, np.ndarray):
+        prediction = prediction.numpy()
+    prediction = (prediction.reshape(-1) * 2) + 0.5
+
+    moveScores = prediction[moveRows]
+    return np.where(pickUpRows == -1, moveScores * 2, moveScores + (prediction[pickUpRows] * 2))
 
 def sortEvals(moveNames, scores):
 
@@ -0,0 +1,290 @@
+"""
+Timings for the hot paths of self-play. Run this file directly to print all of them.
+"""
+import random
+import shutil
+import tempfile
+import time
+
+import chess.variant
+import numpy as np
+import torch
+import ActionToArray
+from ChessConvNet import ChessConvNet
+from ChessEnvironment import ChessEnvironment, boardsToStates
+from MCTSCrazyhouse import MCTS, PUCT_Algorithm
+from NodeStore import NodeStore
+from MyDataset import MyDataset, ReplayDataset, collateRecords
+from ReplayBuffer import ReplayBuffer
+from TrainNetwork import sparsePoissonNLLLoss
+
+
+# positions taken from random games, used by the benchmarks below.
+def randomPositions(numberOfPositions, seed=0):
+    random.seed(seed)
+    positions = []
+    board = chess.variant.CrazyhouseBoard()
+    while len(positions) < numberOfPositions:
+        legalMoves = list(board.legal_moves)
+        if len(legalMoves) == 0 or board.is_game_over():
+            board = chess.variant.CrazyhouseBoard()
+            continue
+        positions.append(board.copy())
+        board.push(random.choice(legalMoves))
+    return positions
+
+
+def arrayBoardFor(pythonChessBoard):
+    arrayBoard = [[" "] * 8 for i in range(8)]
+    for square, piece in pythonChessBoard.piece_map().items():
+        arrayBoard[7 - chess.square_rank(square)][chess.square_file(square)] = piece.symbol()
+    return arrayBoard
+
+
+def benchmarkLegalMoves(numberOfPositions=200):
+    positions = randomPositions(numberOfPositions)
+    arrayBoards = [arrayBoardFor(position) for position in positions]
+
+    start = time.time()
+    for i in range(len(positions)):
+        ActionToArray.legalMovesForStateByProbing(arrayBoards[i], positions[i])
+    probing = (time.time() - start) / len(positions)
+
+    start = time.time()
+    for i in range(len(positions)):
+        ActionToArray.legalMovesForState(arrayBoards[i], positions[i])
+    native = (time.time() - start) / len(positions)
+
+    print("Legal move generation")
+    print("  probing:", round(probing * 1000, 3), "ms per position")
+    print("  native: ", round(native * 1000, 3), "ms per position")
+    print("  speedup:", round(probing / native, 1), "x")
+
+
+def benchmarkEncoding(numberOfPositions=2000):
+    environments = []
+    for position in randomPositions(numberOfPositions):
+        environment = ChessEnvironment()
+        environment.setBoard(position)
+        environments.append(environment)
+
+    start = time.time()
+    for environment in environments:
+        environment.boardToState()
+    single = (time.time() - start) / len(environments)
+
+    states = np.zeros((len(environments), 1, 112, 8), dtype=np.float32)
+    start = time.time()
+    boardsToStates(environments, out=states)
+    batch = (time.time() - start) / len(environments)
+
+    print("State encoding")
+    print("  boardToState:  ", round(single * 1e6, 1), "us per position")
+    print("  boardsToStates:", round(batch * 1e6, 1), "us per position")
+
+
+# an untrained network, so that the benchmarks do not depend on a saved one.
+def randomNetwork(valueHead=False):
+    torch.manual_seed(0)
+    return ChessConvNet(ActionToArray.ACTION_ARRAY_LEN, valueHead).eval()
+
+
+# evaluation of single positions: through MyDataset and a DataLoader as playout used to, and through MCTS.evaluate.
+def benchmarkInference(numberOfPositions=500):
+    environments = []
+    for position in randomPositions(numberOfPositions):
+        environment = ChessEnvironment()
+        environment.setBoard(position)
+        environments.append(environment)
+    treeSearch = MCTS("benchmark.pt")
+    treeSearch.neuralNet = randomNetwork()
+
+    start = time.time()
+    for environment in environments:
+        state = torch.from_numpy(environment.boardToState())
+        nullAction = torch.from_numpy(np.zeros((1, 4504)))
+        loader = torch.utils.data.DataLoader(dataset=MyDataset(state, nullAction), batch_size=1, shuffle=False)
+        with torch.no_grad():
+            for images, labels in loader:
+                treeSearch.neuralNet(images)
+    dataLoader = (time.time() - start) / len(environments)
+
+    latencies = []
+    treeSearch.timingHook = lambda batchSize, seconds: latencies.append(seconds)
+    start = time.time()
+    for environment in environments:
+        states = treeSearch.stateBuffer(1)
+        boardsToStates([environment], out=states.numpy())
+        treeSearch.evaluate(states, [environment.board])
+    evaluate = (time.time() - start) / len(environments)
+
+    print("Single position inference")
+    print("  DataLoader:", round(dataLoader * 1000, 3), "ms per position")
+    print("  evaluate:  ", round(evaluate * 1000, 3), "ms per position, of which",
+          round(np.mean(latencies) * 1000, 3), "ms in the network")
+
+
+# positions added to the tree per second, for single playouts and for batches of playouts.
+def benchmarkPlayouts(playouts=32, batchSizes=(1, 8, 32)):
+    treeSearch = MCTS("benchmark.pt")
+    treeSearch.neuralNet = randomNetwork()
+
+    print("Playouts from the starting position")
+    np.random.seed(0)
+    treeSearch.resetTree()
+    start = time.time()
+    for i in range(playouts):
+        treeSearch.playout(str(i + 1), printPGN=False)
+    print("  playout:".ljust(20), round(len(treeSearch.tree) / (time.time() - start), 1), "nodes/sec")
+
+    for batchSize in batchSizes:
+        np.random.seed(0)
+        treeSearch.resetTree()
+        start = time.time()
+        for i in range(0, playouts, batchSize):
+            treeSearch.playoutBatch(batchSize)
+        print(("  playoutBatch(" + str(batchSize) + "):").ljust(20),
+              round(len(treeSearch.tree) / (time.time() - start), 1), "nodes/sec")
+
+
+# one selection at a node of each width, as chooseEdge used to make it (a Python loop over the children for the
+# unvisited ones, the visits of the parent summed and new noise drawn every time), and as it makes it now.
+def benchmarkSelection(widths=(50, 100, 150), repeats=2000):
+    randomState = np.random.RandomState(0)
+    print("PUCT selection")
+    for width in widths:
+        tree = NodeStore()
+        node = tree.addNode(np.arange(width), randomState.rand(width), 0, randomState.rand(width) * 2 - 1)
+        edges = np.arange(width)[randomState.rand(width) < 0.3]
+        tree.addVisits(edges, 1, 0.5)
+        start, end = tree.edges(node)
+
+        began = time.time()
+        for i in range(repeats):
+            w, n = tree.edgeWin[start:end], tree.edgeSeen[start:end]
+            selfPlayEvaluation = np.divide(w, n, out=np.zeros_like(w), where=n != 0)
+            for j in range(len(selfPlayEvaluation)):
+                if n[j] == 0:
+                    selfPlayEvaluation[j] = 0.5
+            prior = tree.edgePrior[start:end]
+            bounds = 0.6 / 2.5
+            evaluations = prior + (np.random.rand(len(prior)) * 2 * bounds) - bounds
+            np.argmax((evaluations + selfPlayEvaluation) / 2 + 0.15 * np.sqrt(np.sum(n)) / (1 + n))
+        before = (time.time() - began) / repeats
+
+        began = time.time()
+        for i in range(repeats):
+            evaluations = tree.edgePrior[start:end] + (0.6 / 2.5) * tree.edgeNoise[start:end]
+            np.argmax(PUCT_Algorithm(tree.edgeWin[start:end], tree.edgeSeen[start:end], 0.15, tree.nodeSeen[node],
+                                     evaluations))
+        after = (time.time() - began) / repeats
+        print("  " + str(width).rjust(3) + " moves:", round(before * 1e6, 1), "us before,", round(after * 1e6, 1),
+              "us now")
+
+
+# a tree of random nodes, each linked to one of the nodes before it, compacted down to the nodes under one of them:
+# the seconds it takes and the memory of the tree before and after, which should drop with the nodes dropped.
+def benchmarkCompaction(numberOfNodes=20000, width=30):
+    randomState = np.random.RandomState(0)
+    tree = NodeStore()
+    for node in range(numberOfNodes):
+        tree.addNode(randomState.randint(0, len(ActionToArray.MOVE_NAMES), width), randomState.rand(width), node)
+        if node > 0:
+            parent = randomState.randint(0, node)
+            tree.edgeChild[tree.edges(parent)[0] + randomState.randint(0, width)] = node
+    before = tree.memoryUsage()
+    kept = tree.reachable(numberOfNodes // 2)
+    start = time.time()
+    tree.compact(kept)
+    print("Compaction")
+    print("  " + str(numberOfNodes), "nodes down to", len(kept), "in", round((time.time() - start) * 1000, 3), "ms")
+    print("  memory:", round(before / 2 ** 20, 2), "MB before,", round(tree.memoryUsage() / 2 ** 20, 2), "MB after")
+
+
+# playouts per second played to the end of the game, against playouts that stop at the first new position and back
+# up the value of the network.
+def benchmarkLeafEvaluation(playouts=16, batchSize=8):
+    treeSearch = MCTS("benchmark.pt", randomNetwork(valueHead=True))
+
+    print("Playouts per second from the starting position, in batches of", batchSize)
+    for leafEvaluation in [False, True]:
+        np.random.seed(0)
+        treeSearch.resetTree()
+        start = time.time()
+        for i in range(0, playouts, batchSize):
+            treeSearch.playoutBatch(batchSize, leafEvaluation=leafEvaluation)
+        name = "  leaf evaluation:" if leafEvaluation else "  to the end:"
+        print(name.ljust(20), round(playouts / (time.time() - start), 1), "playouts/sec,", len(treeSearch.tree),
+              "nodes")
+    playouts *= 64
+    start = time.time()
+    for i in range(0, playouts, batchSize):
+        treeSearch.playoutBatch(batchSize, leafEvaluation=True)
+    print("  leaf evaluation, " + str(playouts) + " more playouts:", round(playouts / (time.time() - start), 1),
+          "playouts/sec")
+
+    # every node the network has evaluated should be linked into the tree, so that none of them is lost when the tree
+    # is pruned to the most visited move.
+    startBoard = ChessEnvironment()
+    root = treeSearch.dictionary[startBoard.zobristHash]
+    print("  linked from the root:", len(treeSearch.tree.reachable(root)), "of", len(treeSearch.tree), "nodes")
+    startBoard.makeMove(treeSearch.tree.moveNames(root)[int(np.argmax(treeSearch.tree.seen(root)))])
+    newRoot = treeSearch.dictionary[startBoard.zobristHash]
+    children = []
+    for move in treeSearch.tree.moveNames(newRoot):
+        child = startBoard.copy()
+        child.makeMove(move)
+        if child.zobristHash in treeSearch.dictionary:
+            children.append(child.zobristHash)
+    kept, freed = treeSearch.pruneTree(startBoard.zobristHash)
+    survived = sum(1 for child in children if child in treeSearch.dictionary)
+    print("  after one move:", kept, "nodes kept,", freed, "freed,", survived, "of", len(children),
+          "evaluated children kept")
+
+
+# positions per second read from a replay directory by ReplayDataset, against positions per second trained on.
+# The replay is made of random positions, each with one legal move as its target.
+def benchmarkReplayStream(numberOfPositions=4000, positionsPerChunk=100, batchSize=256):
+    directory = tempfile.mkdtemp()
+    replayBuffer = ReplayBuffer(directory)
+    positions = randomPositions(numberOfPositions)
+    for start in range(0, numberOfPositions, positionsPerChunk):
+        records, indices = [], []
+        for position in positions[start:start + positionsPerChunk]:
+            environment = ChessEnvironment()
+            environment.setBoard(position)
+            records.append(environment.toRecord())
+            indices.append(ActionToArray.moveIndex(random.choice(list(position.legal_moves)).uci()))
+        replayBuffer.write(records, np.arange(len(records) + 1), indices, np.ones(len(records)),
+                           np.full(len(records), 0.5))
+
+    start = time.time()
+    batches = list(torch.utils.data.DataLoader(ReplayDataset(directory, shuffleBuffer=1000), batch_size=batchSize,
+                                               collate_fn=collateRecords))
+    streaming = numberOfPositions / (time.time() - start)
+
+    model = randomNetwork().train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    start = time.time()
+    for states, targets, values in batches:
+        loss = sparsePoissonNLLLoss(model(states), targets)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    training = numberOfPositions / (time.time() - start)
+    shutil.rmtree(directory)
+
+    print("Replay stream")
+    print("  ReplayDataset:", round(streaming, 1), "positions/sec")
+    print("  training:     ", round(training, 1), "positions/sec")
+
+
+if __name__ == "__main__":
+    benchmarkLegalMoves()
+    benchmarkEncoding()
+    benchmarkInference()
+    benchmarkSelection()
+    benchmarkCompaction()
+    benchmarkPlayouts()
+    benchmarkLeafEvaluation()
+    benchmarkReplayStream()
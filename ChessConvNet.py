@@ -1,8 +1,13 @@
+import zipfile
+
 import torch
 import torch.nn as nn
 
+# With valueHead, the network also estimates the share of points the side to move will win from the position (0 to
+# 1, as ReplayBuffer values), and forward returns (move array outputs, values). Networks saved before the value head
+# existed have no valueHead attribute and work as before.
 class ChessConvNet(nn.Module):
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, valueHead=False):
         super(ChessConvNet, self).__init__()
         self.layer1 = nn.Sequential(
             nn.Conv2d(1, 16, kernel_size=5, stride=1, padding=2), # 1, 64
@@ -20,11 +25,48 @@ class ChessConvNet(nn.Module):
             nn.Tanh(),
             nn.MaxPool2d(kernel_size=1, stride=1))
         self.fc = nn.Linear(28 * 2 * 64, num_classes)
+        self.valueHead = False
+        if valueHead:
+            self.addValueHead()
+
+    # adds an untrained value head, also to a network trained without one.
+    def addValueHead(self):
+        parameter = self.fc.weight
+        self.value = nn.Sequential(
+            nn.Linear(28 * 2 * 64, 256),
+            nn.ReLU(),
+            nn.Linear(256, 1),
+            nn.Sigmoid()).to(device=parameter.device, dtype=parameter.dtype)
+        self.valueHead = True
 
     def forward(self, x):
         out = self.layer1(x)
         out = self.layer2(out)
         out = self.layer3(out)
         out = out.reshape(out.size(0), -1)
+        if getattr(self, "valueHead", False):
+            return self.fc(out), self.value(out).reshape(-1)
         out = self.fc(out)
-        return out
\ No newline at end of file
+        return out
+
+# the move array outputs and the values (None without a value head) of whatever a network returns.
+def splitOutputs(outputs):
+    if isinstance(outputs, tuple):
+        return outputs[0], outputs[1]
+    return outputs, None
+
+# Loads a network saved with torch.save(model, directory). Networks are whole pickled modules, which torch.load only
+# reads with weights_only=False since torch 2.6. Networks saved in another precision (the older ones are float64) are
+# converted to dtype. TorchScript networks (see QuantizeNetwork) are loaded with torch.jit.load and left as they are.
+def loadNetwork(directory, dtype=torch.float32):
+    if isTorchScript(directory):
+        return torch.jit.load(directory, map_location="cpu")
+    network = torch.load(directory, map_location="cpu", weights_only=False)
+    return network.to(dtype)
+
+# torch.jit.save and torch.save both write zip archives, but only TorchScript archives hold a constants.pkl.
+def isTorchScript(directory):
+    if not zipfile.is_zipfile(directory):
+        return False
+    with zipfile.ZipFile(directory) as archive:
+        return any(name.endswith("/constants.pkl") for name in archive.namelist())
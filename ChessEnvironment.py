@@ -6,72 +6,247 @@ import torch.utils.data as data_utils
 from ChessConvNet import ChessConvNet
 import ActionToArray
 import chess.pgn
+import copy
+
+# index of each piece in pieceArray. 0 is an empty square.
+PIECE_SYMBOLS = " PNBRQKpnbrqk"
+
+# Zobrist keys: a random 63-bit number for each piece on each square, each promoted square, each pocket count,
+# each set of castling rights, each en passant file and the side to move. The hash of a position is the xor of its
+# keys, so a move only has to xor out the keys it removes and xor in the ones it adds. The seed is fixed so every
+# process computes the same hashes. Index 0 of the piece and pocket keys (empty square, empty pocket) is 0.
+def createZobristKeys():
+    random = np.random.RandomState(2019)
+    pieceKeys = random.randint(0, 2 ** 63, size=(13, 64), dtype=np.int64)
+    pieceKeys[0] = 0
+    pocketKeys = random.randint(0, 2 ** 63, size=(10, 33), dtype=np.int64)
+    pocketKeys[:, 0] = 0
+    promotedKeys = random.randint(0, 2 ** 63, size=64, dtype=np.int64)
+    castlingKeys = random.randint(0, 2 ** 63, size=16, dtype=np.int64)
+    castlingKeys[0] = 0
+    enPassantKeys = random.randint(0, 2 ** 63, size=8, dtype=np.int64)
+    turnKey = random.randint(0, 2 ** 63, dtype=np.int64)
+    return pieceKeys.tolist(), pocketKeys.tolist(), promotedKeys.tolist(), castlingKeys.tolist(), \
+        enPassantKeys.tolist(), int(turnKey)
+
+
+ZOBRIST_PIECES, ZOBRIST_POCKETS, ZOBRIST_PROMOTED, ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT, ZOBRIST_TURN = \
+    createZobristKeys()
+
+
+# A board record is the compact state of one position as RECORD_LEN bytes: pieceArray, promotedArray, the white
+# and black pockets (pawn, knight, bishop, rook, queen) and the side to move.
+RECORD_LEN = 64 + 64 + 10 + 1
+PIECE_INDICES = np.arange(1, 13, dtype=np.uint8).reshape((12, 1))
+
+
+# Each square of the captive piece plane is set when one pocket entry (or the side to move) of the record is
+# larger than a threshold: the first row holds white pawns 1-8, the second white pawns 9-16, the third white
+# knights and bishops (4 each), the fourth white rooks and queens, and rows five to eight are the same for black.
+# [7][6] and [7][7] hold the side to move.
+def createCaptiveTable():
+    owner = np.zeros((8, 8), dtype=np.intp)
+    threshold = np.zeros((8, 8), dtype=np.uint8)
+    for colour in range(2):
+        row = colour * 4
+        for i in range(8):
+            owner[row][i], threshold[row][i] = colour * 5, i
+            owner[row + 1][i], threshold[row + 1][i] = colour * 5, 8 + i
+        for i in range(4):
+            owner[row + 2][i], threshold[row + 2][i] = colour * 5 + 1, i
+            owner[row + 2][4 + i], threshold[row + 2][4 + i] = colour * 5 + 2, i
+            owner[row + 3][i], threshold[row + 3][i] = colour * 5 + 3, i
+            owner[row + 3][4 + i], threshold[row + 3][4 + i] = colour * 5 + 4, i
+    owner[7][6], threshold[7][6] = 10, 0
+    owner[7][7], threshold[7][7] = 10, 0
+    return owner.flatten() + 128, threshold.flatten()
+
+
+CAPTIVE_OWNER, CAPTIVE_THRESHOLD = createCaptiveTable()
+
+
+# Encodes N board records into the (N, 1, 112, 8) states of boardToState in one pass. out, when given, must be a
+# contiguous array of that shape and is filled in place.
+def recordsToStates(records, out=None, dtype=np.float32):
+    records = np.asarray(records, dtype=np.uint8).reshape((-1, RECORD_LEN))
+    if out is None:
+        out = np.zeros((len(records), 1, 112, 8), dtype=dtype)
+    planes = out.reshape((len(records), 14, 64))
+
+    np.equal(records[:, None, 0:64], PIECE_INDICES, out=planes[:, 0:12])
+    planes[:, 12] = records[:, 64:128]
+    np.greater(records[:, CAPTIVE_OWNER], CAPTIVE_THRESHOLD, out=planes[:, 13])
+    return out
+
+
+# for each square of the captive piece plane, a one-hot row of the record entry it counts (see createCaptiveTable).
+CAPTIVE_COUNTS = np.eye(11, dtype=np.int64)[CAPTIVE_OWNER - 128]
+
+
+# The inverse of recordsToStates: turns N states back into board records. Pockets hold at most what the captive
+# piece plane can show (16 pawns, 4 of the other pieces, 2 black queens).
+def statesToRecords(states):
+    planes = np.asarray(states).reshape((-1, 14, 64))
+    records = np.zeros((len(planes), RECORD_LEN), dtype=np.uint8)
+    records[:, 0:64] = np.einsum("npq,p->nq", planes[:, 0:12] > 0, PIECE_INDICES.reshape(12).astype(np.int64))
+    records[:, 64:128] = planes[:, 12] > 0
+    counts = (planes[:, 13] > 0).astype(np.int64) @ CAPTIVE_COUNTS
+    records[:, 128:138] = counts[:, 0:10]
+    records[:, 138] = counts[:, 10] > 0
+    return records
+
+
+# Encodes many environments at once, see recordsToStates.
+def boardsToStates(environments, out=None, dtype=np.float32):
+    records = np.zeros((len(environments), RECORD_LEN), dtype=np.uint8)
+    for i in range(len(environments)):
+        environments[i].toRecord(records[i])
+    return recordsToStates(records, out, dtype)
+
+
+# python-chess shares the saved pockets of the move stack between a board and its copies (deepcopy is the same as
+# copy), and puts them back without copying when a move is popped, which it does when checking for repetitions.
+# The copy gets its own saved pockets so that the two boards cannot change each other's pockets.
+def copyBoard(pythonChessBoard):
+    newBoard = pythonChessBoard.copy()
+    newBoard._crazyhouse_stack = copy.deepcopy(newBoard._crazyhouse_stack)
+    return newBoard
+
 
 class ChessEnvironment():
 
     def __init__(self):
         self.board = chess.variant.CrazyhouseBoard()  # this allows legal moves and all
-        self.arrayBoard = [["r", "n", "b", "q", "k", "b", "n", "r"],
-                           ["p", "p", "p", "p", "p", "p", "p", "p"],
-                           [" ", " ", " ", " ", " ", " ", " ", " "],
-                           [" ", " ", " ", " ", " ", " ", " ", " "],
-                           [" ", " ", " ", " ", " ", " ", " ", " "],
-                           [" ", " ", " ", " ", " ", " ", " ", " "],
-                           ["P", "P", "P", "P", "P", "P", "P", "P"],
-                           ["R", "N", "B", "Q", "K", "B", "N", "R"]]
-        self.actuallyAPawn = np.zeros((8, 8))
+
+        # Compact state read from the python-chess bitboards, with squares in the same order as arrayBoard
+        # (a8 to h1). pieceArray holds the PIECE_SYMBOLS index of each square, promotedArray marks pieces that
+        # were once a pawn, and pockets holds the captive pawn, knight, bishop, rook, queen of white and black.
+        self.pieceArray = np.zeros(64, dtype=np.uint8)
+        self.promotedArray = np.zeros(64, dtype=np.uint8)
+        self.pockets = np.zeros((2, 5), dtype=np.uint8)
+
+        self.arrayBoard = [[" "] * 8 for i in range(8)]
+        self.actuallyAPawn = self.promotedArray.reshape((8, 8))
         self.plies = 0
+        # Zobrist hash of the squares and pockets, and of the whole position (see createZobristKeys).
+        self.positionHash = 0
+        self.zobristHash = 0
         # pawn, knight, bishop, rook, queen.
-        self.whiteCaptivePieces = [0, 0, 0, 0, 0]
-        self.blackCaptivePieces = [0, 0, 0, 0, 0]
-
-        # This is required
-        self.wPawnBoard = np.zeros((8, 8))
-        self.bPawnBoard = np.zeros((8, 8))
-        self.wKnightBoard = np.zeros((8, 8))
-        self.bKnightBoard = np.zeros((8, 8))
-        self.wBishopBoard = np.zeros((8, 8))
-        self.bBishopBoard = np.zeros((8, 8))
-        self.wRookBoard = np.zeros((8, 8))
-        self.bRookBoard = np.zeros((8, 8))
-        self.wQueenBoard = np.zeros((8, 8))
-        self.bQueenBoard = np.zeros((8, 8))
-        self.wKingBoard = np.zeros((8, 8))
-        self.bKingBoard = np.zeros((8, 8))
-        self.allBoards = np.zeros((1, 1))  # this will be refreshed anyway
+        self.whiteCaptivePieces = self.pockets[0]
+        self.blackCaptivePieces = self.pockets[1]
+
         self.result = 2  # 2 denotes ongoing, 0 denotes draw, 1 denotes white win, -1 denotes black win
         self.stateFEN = chess.STARTING_FEN  # FEN of starting position
         self.gameStatus = "Game is in progress."
 
+        self.updateSquares(chess.SQUARES)
+
+    # Start from another python-chess board. Everything else is rebuilt from it.
+    def setBoard(self, pythonChessBoard, plies=None):
+        self.board = pythonChessBoard
+        if plies is None:
+            plies = pythonChessBoard.ply()
+        self.plies = plies
+        self.result = 2
+        self.gameStatus = "Game is in progress."
+        self.updateSquares(chess.SQUARES)
+
+    def copy(self):
+        newEnvironment = ChessEnvironment()
+        newEnvironment.board = copyBoard(self.board)
+        newEnvironment.pieceArray[:] = self.pieceArray
+        newEnvironment.promotedArray[:] = self.promotedArray
+        newEnvironment.pockets[:] = self.pockets
+        newEnvironment.arrayBoard = [row[:] for row in self.arrayBoard]
+        newEnvironment.positionHash = self.positionHash
+        newEnvironment.zobristHash = self.zobristHash
+        newEnvironment.plies = self.plies
+        newEnvironment.result = self.result
+        newEnvironment.gameStatus = self.gameStatus
+        return newEnvironment
+
+    # copy.deepcopy would separate the captive piece lists from the pockets they are views of.
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    # python-chess squares (a1 = 0) whose contents change when the move is played on the current board.
+    def changedSquares(self, move):
+        if move.drop:
+            return [move.to_square]
+        squares = [move.from_square, move.to_square]
+        if self.board.is_castling(move):
+            rank = chess.square_rank(move.from_square)
+            if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+                squares += [chess.square(7, rank), chess.square(5, rank)]
+            else:
+                squares += [chess.square(0, rank), chess.square(3, rank)]
+        elif self.board.is_en_passant(move):
+            squares.append(chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)))
+        return squares
+
+    # copy the given squares and the pockets over from the python-chess board, and update the hash with them.
+    def updateSquares(self, squares):
+        positionHash = self.positionHash
+        promoted = self.board.promoted
+        for square in squares:
+            directory = square ^ 56  # python-chess counts rows from the bottom
+            piece = self.board.piece_at(square)
+            if piece is None:
+                newPiece = 0
+                self.arrayBoard[directory // 8][directory % 8] = " "
+            else:
+                symbol = piece.symbol()
+                newPiece = PIECE_SYMBOLS.find(symbol)
+                self.arrayBoard[directory // 8][directory % 8] = symbol
+            oldPiece = int(self.pieceArray[directory])
+            if oldPiece != newPiece:
+                positionHash ^= ZOBRIST_PIECES[oldPiece][directory] ^ ZOBRIST_PIECES[newPiece][directory]
+                self.pieceArray[directory] = newPiece
+
+            newPromoted = (promoted >> square) & 1
+            if self.promotedArray[directory] != newPromoted:
+                positionHash ^= ZOBRIST_PROMOTED[directory]
+                self.promotedArray[directory] = newPromoted
+
+        for colour in range(2):
+            pocket = self.board.pockets[chess.WHITE if colour == 0 else chess.BLACK]
+            for k in range(5):
+                oldCount = int(self.pockets[colour][k])
+                newCount = pocket.count(k + 1)
+                if oldCount != newCount:
+                    keys = ZOBRIST_POCKETS[colour * 5 + k]
+                    positionHash ^= keys[oldCount] ^ keys[newCount]
+                    self.pockets[colour][k] = newCount
+
+        self.positionHash = positionHash
+        self.zobristHash = positionHash ^ self.stateHash()
+
+    # the part of the hash that is not stored in the squares and pockets: castling rights, en passant and turn.
+    def stateHash(self):
+        board = self.board
+        rights = board.castling_rights
+        stateHash = ZOBRIST_CASTLING[(rights & 1) | ((rights >> 6) & 2) | ((rights >> 54) & 4) | ((rights >> 60) & 8)]
+        if board.ep_square is not None and board.has_pseudo_legal_en_passant():
+            stateHash ^= ZOBRIST_EN_PASSANT[chess.square_file(board.ep_square)]
+        if board.turn == chess.BLACK:
+            stateHash ^= ZOBRIST_TURN
+        return stateHash
+
     def boardToFEN(self):
         self.stateFEN = self.board.fen()
         return self.stateFEN
 
+    # readable key of the position. The MCTS uses zobristHash instead, which is much cheaper to keep up to date.
     def boardToString(self):
-        state = "0000000000000000000000000000000000000000000000000000000000000000"
-        for i in range(8):
-            for j in range(8):
-                if self.arrayBoard[i][j] != " ":
-                    direc = i * 8 + j
-                    # change something
-                    state = state[0:direc] + self.arrayBoard[i][j] + state[direc + 1:]
-        captive = str(self.whiteCaptivePieces[0]) + str(self.whiteCaptivePieces[1]) \
-                  + str(self.whiteCaptivePieces[2]) + str(self.whiteCaptivePieces[3]) \
-                  + str(self.whiteCaptivePieces[4]) + str(self.blackCaptivePieces[0]) \
-                  + str(self.blackCaptivePieces[1]) + str(self.blackCaptivePieces[2]) \
-                  + str(self.blackCaptivePieces[3]) + str(self.blackCaptivePieces[4])
+        state = "".join(["".join(row) for row in self.arrayBoard]).replace(" ", "0")
+        captive = "".join([str(count) for count in self.pockets.flatten().tolist()])
 
         turn = str(self.plies % 2)
 
-        castling = '0000'
-        if self.board.has_kingside_castling_rights(chess.WHITE):
-            castling = '1000'
-        if self.board.has_queenside_castling_rights(chess.WHITE):
-            castling = castling[0] + '100'
-        if self.board.has_kingside_castling_rights(chess.BLACK):
-            castling = castling[0:2] + '10'
-        if self.board.has_queenside_castling_rights(chess.BLACK):
-            castling = castling[0:3] + '1'
+        castling = ""
+        for colour in [chess.WHITE, chess.BLACK]:
+            castling += str(int(self.board.has_kingside_castling_rights(colour)))
+            castling += str(int(self.board.has_queenside_castling_rights(colour)))
         return state + captive + castling + turn
 
     def gameResult(self):
@@ -93,234 +268,42 @@ class ChessEnvironment():
                 self.result = 1
                 self.gameStatus = "White Victory"
 
-    def updateNumpyBoards(self):
-
-        # Before updating states, one must refresh the boards.
-        self.wPawnBoard = np.zeros((8, 8))
-        self.bPawnBoard = np.zeros((8, 8))
-        self.wKnightBoard = np.zeros((8, 8))
-        self.bKnightBoard = np.zeros((8, 8))
-        self.wBishopBoard = np.zeros((8, 8))
-        self.bBishopBoard = np.zeros((8, 8))
-        self.wRookBoard = np.zeros((8, 8))
-        self.bRookBoard = np.zeros((8, 8))
-        self.wQueenBoard = np.zeros((8, 8))
-        self.bQueenBoard = np.zeros((8, 8))
-        self.wKingBoard = np.zeros((8, 8))
-        self.bKingBoard = np.zeros((8, 8))
-
-        for i in range(8):
-            for j in range(8):
-                if self.arrayBoard[i][j] == "P":
-                    self.wPawnBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "p":
-                    self.bPawnBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "N":
-                    self.wKnightBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "n":
-                    self.bKnightBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "B":
-                    self.wBishopBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "b":
-                    self.bBishopBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "R":
-                    self.wRookBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "r":
-                    self.bRookBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "Q":
-                    self.wQueenBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "q":
-                    self.bQueenBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "K":
-                    self.wKingBoard[i][j] = 1
-                if self.arrayBoard[i][j] == "k":
-                    self.bKingBoard[i][j] = 1
-                # once all boards are done, concatenate them into the state
-                self.allBoards = np.concatenate((self.wPawnBoard, self.wKnightBoard, self.wBishopBoard, self.wRookBoard,
-                                                 self.wQueenBoard, self.wKingBoard,
-                                                 self.bPawnBoard, self.bKnightBoard, self.bBishopBoard, self.bRookBoard,
-                                                 self.bQueenBoard, self.bKingBoard, self.actuallyAPawn
-                                                 ))
-
     def makeMove(self, move):
         if chess.Move.from_uci(move) in self.board.legal_moves:
-            self.board.push(chess.Move.from_uci(move))
-            # update numpy board too - split the move and find coordinates! see old chess java work.
-            rowNames = "abcdefgh"
-            if move[1] != "@":
-                initialRow = 8 - int(move[1])  # for e2d4, move[1] returns 2
-            else:
-                initialRow = 0
-            initialCol = int(rowNames.find(move[0]))  # for e2d4, move[1] returns e
-            finalRow = 8 - int(move[3])  # for e2d4, move[3] returns 4
-            finalCol = int(rowNames.find(move[2]))  # for e2d4, move[2] returns d
-            # SPECIAL MOVE 1: CASTLING. MAKE SURE THAT THE PIECE IN QUESTION IS A KING!!!
-            if move == "e1g1" and self.arrayBoard[7][4] == "K" and self.arrayBoard[7][7] == "R":
-                self.arrayBoard[7][4] = " "
-                self.arrayBoard[7][7] = " "
-                self.arrayBoard[7][5] = "R"
-                self.arrayBoard[7][6] = "K"
-            elif move == "e8g8" and self.arrayBoard[0][4] == "k" and self.arrayBoard[0][7] == "r":
-                self.arrayBoard[0][4] = " "
-                self.arrayBoard[0][7] = " "
-                self.arrayBoard[0][5] = "R"
-                self.arrayBoard[0][6] = "K"
-            elif move == "e8c8" and self.arrayBoard[0][4] == "k" and self.arrayBoard[0][0] == "r":
-                self.arrayBoard[0][0] = " "
-                self.arrayBoard[0][1] = " "
-                self.arrayBoard[0][4] = " "
-                self.arrayBoard[0][2] = "K"
-                self.arrayBoard[0][3] = "R"
-            elif move == "e1c1" and self.arrayBoard[7][4] == "K" and self.arrayBoard[7][0] == "R":
-                self.arrayBoard[7][0] = " "
-                self.arrayBoard[7][1] = " "
-                self.arrayBoard[7][4] = " "
-                self.arrayBoard[7][2] = "K"
-                self.arrayBoard[7][3] = "R"
-            # SPECIAL MOVE 2: EN PASSANT
-            # check if the capture square is empty and there is a pawn on the same row but different column
-            # white en passant
-            elif self.arrayBoard[initialRow][initialCol] == "P" and self.arrayBoard[initialRow][finalCol] == "p" and \
-                    self.arrayBoard[finalRow][finalCol] == " ":
-                # print("WHITE EN PASSANT")
-                self.arrayBoard[initialRow][initialCol] = " "
-                self.arrayBoard[finalRow][finalCol] = "P"
-                self.arrayBoard[initialRow][finalCol] = " "
-                self.whiteCaptivePieces[0] += 1
-            # black en passant
-            elif self.arrayBoard[initialRow][initialCol] == "p" and self.arrayBoard[initialRow][finalCol] == "P" and \
-                    self.arrayBoard[finalRow][finalCol] == " ":
-                # print("BLACK EN PASSANT")
-                self.arrayBoard[initialRow][initialCol] = " "
-                self.arrayBoard[finalRow][finalCol] = "p"
-                self.arrayBoard[initialRow][finalCol] = " "
-                self.blackCaptivePieces[0] += 1
-            elif "PRNBQ".find(move[0]) == -1:
-                # update the board
-                temp = self.arrayBoard[finalRow][finalCol]
-                self.arrayBoard[finalRow][finalCol] = self.arrayBoard[initialRow][initialCol]
-                self.arrayBoard[initialRow][initialCol] = " "
-
-                # move around the actuallyAPawn stuff too.
-                wasAPawn = self.actuallyAPawn[finalRow][finalCol]
-                self.actuallyAPawn[finalRow][finalCol] = self.actuallyAPawn[initialRow][initialCol]
-                self.actuallyAPawn[initialRow][initialCol] = 0
-
-                # this is for promotion
-                if len(move) == 5:
-                    if self.plies % 2 == 0:
-                        self.arrayBoard[finalRow][finalCol] = move[4].upper()
-                    if self.plies % 2 == 1:
-                        self.arrayBoard[finalRow][finalCol] = move[4].lower()
-                    self.actuallyAPawn[finalRow][finalCol] = 1
-
-                # add pieces to captured area
-                if wasAPawn == 0:  # 0 means it is normal.
-                    whiteCaptured = "pnbrq".find(temp)
-                    blackCaptured = "PNBRQ".find(temp)
-                    if whiteCaptured > -1:
-                        self.whiteCaptivePieces[whiteCaptured] += 1
-                    if blackCaptured > -1:
-                        self.blackCaptivePieces[blackCaptured] += 1
-                if wasAPawn == 1:  # 1 means that the piece in question was once a pawn.
-                    if self.plies % 2 == 0:
-                        self.whiteCaptivePieces[0] += 1
-                    if self.plies % 2 == 1:
-                        self.blackCaptivePieces[0] += 1
-
-            else:
-                # this is when a captured piece is put back on the board
-
-                # update the captive pieces
-                placed = "PNBRQ".find(move[0])
-                if self.plies % 2 == 0:
-                    self.whiteCaptivePieces[placed] -= 1
-                if self.plies % 2 == 1:
-                    self.blackCaptivePieces[placed] -= 1
-
-                # update the board.
-                rowNames = "abcdefgh"
-                placedRow = 8 - int(move[3])
-                placedCol = int(rowNames.find(move[2]))
-
-                if self.plies % 2 == 0:
-                    self.arrayBoard[placedRow][placedCol] = move[0]
-                if self.plies % 2 == 1:
-                    self.arrayBoard[placedRow][placedCol] = move[0].lower()
+            move = chess.Move.from_uci(move)
+            # only the squares touched by the move need to be read back from the board.
+            squares = self.changedSquares(move)
+            self.board.push(move)
+            self.updateSquares(squares)
 
             # once everything is done, update move count
-            self.updateNumpyBoards()
             self.plies += 1
         else:
             print(move)
             print("Illegal Move!")
 
+    def unmakeMove(self):
+        move = self.board.pop()
+        self.updateSquares(self.changedSquares(move))
+        self.plies -= 1
+        self.result = 2
+        self.gameStatus = "Game is in progress."
+        return move.uci()
+
     def printBoard(self):
         print(self.board)
         print(self.arrayBoard)
         print(self.whiteCaptivePieces)
         print(self.blackCaptivePieces)
 
-    def boardToState(self):
-
-        captiveToBinary = np.zeros((8, 8))
-
-        # Create copies of whiteCaptive and blackCaptive
-        temp1 = np.copy(self.whiteCaptivePieces)
-        temp2 = np.copy(self.blackCaptivePieces)
-
-        # start off by updating pawns.
-        for i in range(8):
-            if temp1[0] > 0:
-                captiveToBinary[0][i] = 1
-                temp1[0] -= 1
-            if temp2[0] > 0:
-                captiveToBinary[4][i] = 1
-                temp2[0] -= 1
-        for i in range(8):
-            if temp1[0] > 0:
-                captiveToBinary[1][i] = 1
-                temp1[0] -= 1
-            if temp2[0] > 0:
-                captiveToBinary[5][i] = 1
-                temp2[0] -= 1
-
-        # then, update knights, bishops, and rooks, and then queen.
-        for i in range(4):
-            if temp1[1] > 0:
-                captiveToBinary[2][i] = 1
-                temp1[1] -= 1
-            if temp1[2] > 0:
-                captiveToBinary[2][4 + i] = 1
-                temp1[2] -= 1
-            if temp1[3] > 0:
-                captiveToBinary[3][i] = 1
-                temp1[3] -= 1
-            if temp1[4] > 0:
-                captiveToBinary[3][4 + i] = 1
-                temp1[4] -= 1
-            if temp2[1] > 0:
-                captiveToBinary[6][i] = 1
-                temp2[1] -= 1
-            if temp2[2] > 0:
-                captiveToBinary[6][4 + i] = 1
-                temp2[2] -= 1
-            if temp2[3] > 0:
-                captiveToBinary[7][i] = 1
-                temp2[3] -= 1
-            if temp2[4] > 0:
-                captiveToBinary[7][4 + i] = 1
-                temp2[4] -= 1
-
-            # [7][6], [7][7] determine who is moving
-            captiveToBinary[7][6], captiveToBinary[7][7] = (self.plies % 2), (self.plies % 2)
-
-            # need four more entries to determine who can castle...
-            # [3][6], [3][7]
-            # captiveToBinary[3][6] = self.board.castling_rights
-
-        self.updateNumpyBoards()
-
-        # perhaps work on adding 1s for spaces....
-        return np.reshape(np.concatenate((self.allBoards, captiveToBinary)), (1, 1, 112, 8))  # 32, 26, or 104, 8
+    def toRecord(self, out=None):
+        if out is None:
+            out = np.zeros(RECORD_LEN, dtype=np.uint8)
+        out[0:64] = self.pieceArray
+        out[64:128] = self.promotedArray
+        out[128:138] = self.pockets.reshape(10)
+        out[138] = self.plies % 2
+        return out
 
+    def boardToState(self):
+        return recordsToStates(self.toRecord())  # 32, 26, or 104, 8
@@ -0,0 +1,82 @@
+"""
+A TorchScript copy of a trained network for inference.
+
+Saved networks are pickled modules: loading one needs ChessConvNet importable under the same name and rebuilds the
+module through Python, and every forward pass goes through the Python code of the module. exportNetwork folds each
+batch norm into the convolution before it (the batch norms are frozen in eval mode, so they are only a scale and a
+shift of its outputs), traces the network and freezes it, so that its weights become constants of one graph that
+TorchScript can run and optimize by itself. The file is loaded by ChessConvNet.loadNetwork like any other network,
+without ChessConvNet.
+
+An exported network is only for inference: it runs in the precision it was exported in and cannot be trained.
+"""
+import copy
+import time
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from ChessConvNet import loadNetwork, splitOutputs
+from ChessEnvironment import ChessEnvironment
+
+
+# a copy of network in eval mode with every Conv2d followed by a BatchNorm2d replaced by one convolution.
+def foldBatchNorms(network):
+    network = copy.deepcopy(network).eval()
+    for module in network.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            if isinstance(module[i], nn.Conv2d) and isinstance(module[i + 1], nn.BatchNorm2d):
+                module[i] = fuse_conv_bn_eval(module[i], module[i + 1])
+                module[i + 1] = nn.Identity()
+    return network
+
+
+# traces network on a batch of states (a tensor), freezes it and saves it as TorchScript.
+def saveScript(network, states, directory):
+    with torch.no_grad():
+        script = torch.jit.freeze(torch.jit.trace(network.eval(), states))
+    torch.jit.save(script, directory)
+
+
+def startingState(dtype=torch.float32):
+    return torch.from_numpy(ChessEnvironment().boardToState()).to(dtype)
+
+
+def exportNetwork(network, directory, dtype=torch.float32):
+    saveScript(foldBatchNorms(network).to(dtype), startingState(dtype), directory)
+
+
+# exports the network saved at directory to saveDirectory. Prints and returns how much the outputs differ, and the
+# seconds taken to load each and to run each on one position.
+def exportSavedNetwork(directory, saveDirectory, dtype=torch.float32, repeats=100):
+    start = time.time()
+    network = loadNetwork(directory, dtype).eval()
+    loadTime = time.time() - start
+    exportNetwork(network, saveDirectory, dtype)
+    start = time.time()
+    script = loadNetwork(saveDirectory)
+    scriptLoadTime = time.time() - start
+
+    state = startingState(dtype)
+    with torch.inference_mode():
+        difference = torch.max(torch.abs(splitOutputs(network(state))[0] - splitOutputs(script(state))[0])).item()
+        times = []
+        for model in [network, script]:
+            for i in range(10):
+                model(state)
+            start = time.time()
+            for i in range(repeats):
+                model(state)
+            times.append((time.time() - start) / repeats)
+
+    print("Exported", directory, "to", saveDirectory + ", largest output difference", round(difference, 6))
+    print("  loading:", round(loadTime * 1000, 1), "ms module,", round(scriptLoadTime * 1000, 1), "ms TorchScript")
+    print("  one position:", round(times[0] * 1000, 3), "ms module,", round(times[1] * 1000, 3), "ms TorchScript")
+    return {"difference": difference, "loadTime": loadTime, "scriptLoadTime": scriptLoadTime,
+            "latency": times[0], "scriptLatency": times[1]}
+
+
+if __name__ == "__main__":
+    exportSavedNetwork("supervised.pt", "supervised-script.pt")
@@ -0,0 +1,215 @@
+"""
+A process that holds the only copy of the network and evaluates positions for many search processes at once.
+
+Every client owns a slot in two blocks of shared memory, one for its states and one for the outputs of the network.
+A client writes its states into its slot, puts (slot, number of states, time sent) on the request queue and waits
+on the semaphore of its slot. The server takes the first request off the queue, keeps gathering requests until the
+next one would take the batch over maxBatchSize states or maxWait seconds have passed, runs them through the network
+in one batch, copies each output into its slot and releases the semaphores. A request that did not fit starts the
+next batch.
+
+Clients behave like the network itself (states in, outputs out), so they can be given to MCTS as its network. For a
+network with a value head, start the server with values=True: every output row then has the value of the position
+after the move array, and clients return (move array outputs, values) as the network does.
+"""
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+import ActionToArray
+import ChessConvNet
+
+STATE_SHAPE = (1, 112, 8)
+TORCH_DTYPES = {np.dtype(np.float32): torch.float32, np.dtype(np.float64): torch.float64}
+
+
+# the length of an output row.
+def outputLength(values):
+    return ActionToArray.ACTION_ARRAY_LEN + (1 if values else 0)
+
+
+def serve(directory, network, requestQueue, semaphores, inputName, outputName, slots, maxPositions, maxBatchSize,
+          maxWait, dtype, values, statisticsQueue):
+    if network is None:
+        network = ChessConvNet.loadNetwork(directory, TORCH_DTYPES[dtype]).eval()
+    inputMemory = shared_memory.SharedMemory(name=inputName)
+    outputMemory = shared_memory.SharedMemory(name=outputName)
+    inputs = np.ndarray((slots, maxPositions) + STATE_SHAPE, dtype=dtype, buffer=inputMemory.buf)
+    outputs = np.ndarray((slots, maxPositions, outputLength(values)), dtype=dtype, buffer=outputMemory.buf)
+
+    histogram = {}  # number of states in a batch = number of batches of that size
+    queueLatencies = []  # seconds between a request being sent and its batch starting
+
+    stopping = False
+    waiting = None  # a request that did not fit in the last batch, which starts the next one.
+    while not stopping:
+        request = waiting if waiting is not None else requestQueue.get()
+        waiting = None
+        if request is None:
+            break
+        batch = [request]
+        positions = request[1]
+        deadline = time.time() + maxWait
+        while positions < maxBatchSize:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = requestQueue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                stopping = True
+                break
+            if positions + request[1] > maxBatchSize:
+                waiting = request
+                break
+            batch.append(request)
+            positions += request[1]
+
+        started = time.time()
+        states = np.concatenate([inputs[slot, 0:n] for slot, n, sent in batch])
+        with torch.inference_mode():
+            predictions, positionValues = ChessConvNet.splitOutputs(network(torch.from_numpy(states)))
+            predictions = predictions.numpy()
+            if values:
+                predictions = np.concatenate((predictions, positionValues.numpy().reshape((-1, 1))), 1)
+
+        offset = 0
+        for slot, n, sent in batch:
+            outputs[slot, 0:n] = predictions[offset:offset + n]
+            offset += n
+            queueLatencies.append(started - sent)
+            semaphores[slot].release()
+        histogram[positions] = histogram.get(positions, 0) + 1
+
+    del inputs, outputs
+    inputMemory.close()
+    outputMemory.close()
+    statisticsQueue.put((histogram, queueLatencies))
+
+
+class InferenceClient():
+
+    def __init__(self, slot, inputName, outputName, slots, maxPositions, dtype, values, requestQueue, semaphore):
+        self.slot = slot
+        self.inputName = inputName
+        self.outputName = outputName
+        self.slots = slots
+        self.maxPositions = maxPositions
+        self.dtype = dtype
+        self.values = values
+        self.requestQueue = requestQueue
+        self.semaphore = semaphore
+        self.inputMemory = None
+
+    # the shared memory is attached the first time the client is used, in the process that uses it.
+    def attach(self):
+        self.inputMemory = shared_memory.SharedMemory(name=self.inputName)
+        self.outputMemory = shared_memory.SharedMemory(name=self.outputName)
+        self.inputs = np.ndarray((self.slots, self.maxPositions) + STATE_SHAPE, dtype=self.dtype,
+                                 buffer=self.inputMemory.buf)[self.slot]
+        self.outputs = np.ndarray((self.slots, self.maxPositions, outputLength(self.values)), dtype=self.dtype,
+                                  buffer=self.outputMemory.buf)[self.slot]
+
+    def __call__(self, states):
+        if self.inputMemory is None:
+            self.attach()
+        states = np.asarray(states).reshape((-1,) + STATE_SHAPE)
+        outputs = np.zeros((len(states), outputLength(self.values)), dtype=self.dtype)
+        for start in range(0, len(states), self.maxPositions):
+            n = min(self.maxPositions, len(states) - start)
+            self.inputs[0:n] = states[start:start + n]
+            self.requestQueue.put((self.slot, n, time.time()))
+            self.semaphore.acquire()
+            outputs[start:start + n] = self.outputs[0:n]
+        if self.values:
+            return torch.from_numpy(outputs[:, 0:-1]), torch.from_numpy(outputs[:, -1])
+        return torch.from_numpy(outputs)
+
+    # the network is always in eval mode on the server.
+    def eval(self):
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ["outputMemory", "inputs", "outputs"]:
+            state.pop(name, None)
+        state["inputMemory"] = None
+        return state
+
+
+class InferenceServer():
+
+    # directory is the saved network, as for MCTS. network, when given, is used instead.
+    # slots is the number of clients, and maxPositions the most states a client sends in one request. No batch is
+    # larger than maxBatchSize states, so it cannot be smaller than maxPositions.
+    # values is True if the network has a value head.
+    def __init__(self, directory, network=None, slots=1, maxPositions=64, maxBatchSize=256, maxWait=0.002,
+                 dtype=np.float32, values=False):
+        if maxPositions > maxBatchSize:
+            raise ValueError("maxPositions is larger than maxBatchSize")
+        self.directory = directory
+        self.network = network
+        self.slots = slots
+        self.maxPositions = maxPositions
+        self.maxBatchSize = maxBatchSize
+        self.maxWait = maxWait
+        self.dtype = np.dtype(dtype)
+        self.values = values
+        self.process = None
+
+    def start(self):
+        positions = self.slots * self.maxPositions
+        self.inputMemory = shared_memory.SharedMemory(
+            create=True, size=positions * int(np.prod(STATE_SHAPE)) * self.dtype.itemsize)
+        self.outputMemory = shared_memory.SharedMemory(
+            create=True, size=positions * outputLength(self.values) * self.dtype.itemsize)
+        self.requestQueue = multiprocessing.Queue()
+        self.statisticsQueue = multiprocessing.Queue()
+        self.semaphores = [multiprocessing.Semaphore(0) for i in range(self.slots)]
+        self.process = multiprocessing.Process(
+            target=serve, daemon=True,
+            args=(self.directory, self.network, self.requestQueue, self.semaphores, self.inputMemory.name,
+                  self.outputMemory.name, self.slots, self.maxPositions, self.maxBatchSize, self.maxWait, self.dtype,
+                  self.values, self.statisticsQueue))
+        self.process.start()
+        return self
+
+    def client(self, slot):
+        return InferenceClient(slot, self.inputMemory.name, self.outputMemory.name, self.slots, self.maxPositions,
+                               self.dtype, self.values, self.requestQueue, self.semaphores[slot])
+
+    def clients(self):
+        return [self.client(slot) for slot in range(self.slots)]
+
+    # stops the server, prints its statistics and returns them as (batch size histogram, queue latencies).
+    def stop(self):
+        self.requestQueue.put(None)
+        histogram, queueLatencies = self.statisticsQueue.get()
+        self.process.join()
+        self.process = None
+        self.inputMemory.close()
+        self.inputMemory.unlink()
+        self.outputMemory.close()
+        self.outputMemory.unlink()
+        printStatistics(histogram, queueLatencies)
+        return histogram, queueLatencies
+
+
+def printStatistics(histogram, queueLatencies):
+    batches = sum(histogram.values())
+    positions = sum(size * count for size, count in histogram.items())
+    print("Inference server:", batches, "batches,", positions, "positions")
+    if batches == 0:
+        return
+    print("  average batch size:", round(positions / batches, 2))
+    print("  batch sizes:")
+    for size in sorted(histogram):
+        print("    " + str(size).rjust(5) + ":", histogram[size])
+    latencies = np.array(queueLatencies) * 1000
+    print("  queue latency: mean", round(np.mean(latencies), 3), "ms, median", round(np.median(latencies), 3),
+          "ms, 95th percentile", round(np.percentile(latencies, 95), 3), "ms")
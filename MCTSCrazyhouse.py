@@ -18,13 +18,14 @@ a) Do lists allow for different sized entries? i.e. can list[0] be an array of 1
 import datetime
 
 import numpy as np
-import copy
 import chess.variant
 import chess.pgn
 import chess
 import time
-from ChessEnvironment import ChessEnvironment
-from MyDataset import MyDataset
+from ChessEnvironment import ChessEnvironment, boardsToStates, recordsToStates
+from TranspositionTable import TranspositionTable
+from NodeStore import NodeStore
+from PositionAccumulator import PositionAccumulator
 import ActionToArray
 import ChessConvNet
 import torch
@@ -43,11 +44,8 @@ def zeroList(n):
 # Q is the evaluation from -1 to 1 of the neural network
 # UCT Algorithm used by Alpha Zero.
 def PUCT_Algorithm(w, n, c, N, q):
-    # Provides a win rate score from 0 to 1
-    selfPlayEvaluation = np.divide(w, n, out=np.zeros_like(w), where=n != 0)
-    for i in range(len(selfPlayEvaluation)):
-        if n[i] == 0:
-            selfPlayEvaluation[i] = 0.5
+    # Provides a win rate score from 0 to 1, and 0.5 for moves that have not been visited.
+    selfPlayEvaluation = np.where(n != 0, w / np.maximum(n, 1), 0.5)
     nnEvaluation = q
     winRate = (nnEvaluation + selfPlayEvaluation) / 2
 
@@ -58,81 +56,252 @@ def PUCT_Algorithm(w, n, c, N, q):
     return PUCT
 
 
-def noiseEvals(nnEvals, bounds):
+# scales the evaluations from 0 to 1.
+def scaleEvaluations(evaluations):
+    if len(evaluations) > 0:
+        minVal = np.amin(evaluations)  # pretend this is -2
+        maxVal = np.amax(evaluations)  # pretend this is 10
+        if minVal != maxVal:
+            multiplier = maxVal - minVal  # then multiplier is 12. max = 10/12, min = -2/12
+            try:
+                center = minVal / multiplier
+            except ZeroDivisionError:
+                center = 0
+            evaluations = (evaluations / multiplier)
+            evaluations = evaluations - center
+        else:
+            evaluations = evaluations / maxVal
+    return evaluations
+
+
+# the output of the network for a position in the compact form kept by the tree: the move ids of the legal moves
+# (see ActionToArray.MOVE_IDS) and their scaled evaluations.
+def legalMovePriors(pythonChessBoard, prediction):
+    legalMoves = ActionToArray.legalMovesForState(None, pythonChessBoard)
+    moveIds = np.array([ActionToArray.MOVE_IDS[move] for move in legalMoves], dtype=np.int64)
+    evaluations = ActionToArray.moveEvaluationsBatch(legalMoves, prediction,
+                                                     (ActionToArray.MOVE_INDEX[moveIds],
+                                                      ActionToArray.PICKUP_INDEX[moveIds]))
+    return moveIds, scaleEvaluations(evaluations)
+
+
+# uniform numbers in [-1, 1), one per edge of a new node, which chooseEdge scales into noise on its evaluations.
+# rng is np.random or a np.random.Generator.
+def unitNoise(n, rng=np.random):
+    return rng.random(n) * 2 - 1
+
+
+def noiseEvals(nnEvals, bounds, rng=np.random):
     # this diversifies training data during its self-play games, in order to ensure that the computer looks at a lot of
     # different positions.
-    noise = (np.random.rand(len(nnEvals)) * 2 * bounds) - (bounds)
+    noise = (rng.random(len(nnEvals)) * 2 * bounds) - (bounds)
     return noise + nnEvals
 
 
+# points for white and black for each game result.
+RESULT_SCORES = {1: (1, 0), 0: (0.5, 0.5), -1: (0, 1)}
+EVICTION_POLICIES = ["lru", "visits"]
+
+
 class MCTS():
 
-    # We will use three lists:
-    # seenStates stores the gameStates that have been seen. This is a library.
-    # parentSeen stores the times that the current gameState has been seen
-    # Each game state corresponds to arrays of the possible moves
+    # The tree has two parts:
+    # dictionary maps the zobrist hash of each position that has been seen to its node in the tree.
+    # tree (a NodeStore) holds the children of each node, one per legal move.
     # There are 3 points information stored for each of the children
     # - win count, number of times visited, and neural network evaluation
     # This is helpful because we get to use numpy stuffs.
 
-    def __init__(self, directory):
-
-        self.dictionary = {
-            # 'string' = n position. Let this string be the FEN of the position.
-        }
-        self.childrenMoveNames = []  # a 2D list, each directory may be of different size, stores name of moves
-        self.childrenStateSeen = []  # a 2D list, each directory contains numpy array
-        self.childrenStateWin = []  # a 2D list, each directory contains numpy array
-        self.childrenNNEvaluation = []  # a 2D list, each directory contains numpy array
-        try:
-            self.neuralNet = torch.load(directory)
-        except:
-            print("Network not found!")
+    # network, when given, is used instead of loading the one saved at directory. The network is run in dtype, or
+    # under bfloat16 autocast with autocast.
+    # With maxNodes, the tree never holds more than maxNodes positions after a playout: the least recently visited
+    # ones (eviction "lru") or the least visited ones ("visits") are dropped (see enforceBudget).
+    # With leafEvaluation, playouts stop at the first position that is not in the tree and back up the value the
+    # network gives it, instead of playing on to the end of the game (see playoutBatch). The network needs a value
+    # head for this.
+    # With dirichletAlpha, the noise of training playouts is Dirichlet noise on the root of each search only, drawn
+    # once per search and mixed into the evaluations of the root by dirichletFraction (see startSearch), instead of
+    # uniform noise at every node. Random numbers come from self.rng: np.random, or a generator seeded with seed (see
+    # seedSearch).
+    def __init__(self, directory, network=None, dtype=torch.float32, autocast=False, maxNodes=None, eviction="lru",
+                 leafEvaluation=False, dirichletAlpha=None, dirichletFraction=0.25, seed=None):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError("Unknown eviction policy: " + str(eviction))
+
+        self.dictionary = TranspositionTable()  # zobrist hash of the position = n position.
+        self.tree = NodeStore()
+        self.states = None  # reused input tensor of the network, see stateBuffer.
+        self.timingHook = None  # if set, called with the batch size and seconds taken by each evaluate.
+        self.dtype = dtype
+        self.autocast = autocast
+        self.maxNodes = maxNodes
+        self.eviction = eviction
+        self.nodesEvicted = 0
+        self.leafEvaluation = leafEvaluation
+        self.dirichletAlpha = dirichletAlpha
+        self.dirichletFraction = dirichletFraction
+        self.rootPosition = None  # position the current search started from, and the Dirichlet noise of its moves.
+        self.rootNoise = None
+        self.rng = np.random
+        if seed is not None:
+            self.seedSearch(seed)
+        if network is not None:
+            self.neuralNet = network
+        else:
+            try:
+                self.neuralNet = ChessConvNet.loadNetwork(directory, dtype).eval()
+            except:
+                print("Network not found!")
         self.nameOfNetwork = directory[0:-3]
 
+    # makes the random numbers of the search (the noise, not the network) start again from seed, e.g. for each game.
+    def seedSearch(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    # starts a search from the position of the environment. With Dirichlet noise, the position is added to the tree if
+    # it is not there yet and the noise of its moves is drawn, for every playout of the search to use. The evaluations
+    # are scaled scores rather than probabilities, so the noise is scaled by their sum, as if both were mixed as
+    # probabilities and scaled back.
+    def startSearch(self, environment):
+        if self.dirichletAlpha is None:
+            return
+        if environment.zobristHash not in self.dictionary:
+            self.expandPositions([environment])
+        prior = self.tree.prior(self.dictionary[environment.zobristHash])
+        self.rootPosition = environment.zobristHash
+        self.rootNoise = (self.rng.dirichlet(np.full(len(prior), self.dirichletAlpha)) * np.sum(prior)).astype(
+            np.float32)
+
+    # the evaluations of the root of the search with its Dirichlet noise mixed in.
+    def rootEvaluations(self, node):
+        return (1 - self.dirichletFraction) * self.tree.prior(node) + self.dirichletFraction * self.rootNoise
+
+    # refresh the MCTS tree from scratch.
+    def resetTree(self):
+        self.dictionary = TranspositionTable()
+        self.tree = NodeStore()
+
+    # keeps only the part of the tree that can be reached from the position (its statistics are kept as they are),
+    # and drops everything else. Returns the number of nodes kept and the number dropped.
+    def pruneTree(self, position):
+        nodesBefore = len(self.tree)
+        root = self.dictionary.get(position)
+        if root is None:
+            self.resetTree()
+            return 0, nodesBefore
+        self.keepNodes(self.tree.reachable(root))
+        return len(self.tree), nodesBefore - len(self.tree)
+
+    # drops all the nodes but the given ones (in increasing order), and rebuilds the dictionary for their new indices.
+    def keepNodes(self, nodes):
+        self.tree.compact(nodes)
+        self.dictionary = TranspositionTable(max(1024, 1 << (2 * len(self.tree)).bit_length()))
+        for node, key in enumerate(self.tree.nodeKey[0:len(self.tree)].tolist()):
+            self.dictionary[key] = node
+
+    # if the tree holds more than maxNodes positions, evicts nodes until it holds three quarters of maxNodes (so that
+    # it is not compacted again after every playout). The node of the position is always kept. Playouts still find
+    # the positions under an evicted node through the dictionary. Returns the number of nodes evicted.
+    def enforceBudget(self, position):
+        if self.maxNodes is None or len(self.tree) <= self.maxNodes:
+            return 0
+        if self.eviction == "lru":
+            scores = self.tree.nodeVisited[0:len(self.tree)].astype(np.float64)
+        else:
+            scores = self.tree.visits().astype(np.float64)
+        root = self.dictionary.get(position)
+        if root is not None:
+            scores[root] = np.inf
+        keep = max(1, (3 * self.maxNodes) // 4)
+        evicted = len(self.tree) - keep
+        self.keepNodes(np.sort(np.argpartition(-scores, keep - 1)[0:keep]))
+        self.nodesEvicted += evicted
+        return evicted
+
+    # the number of nodes and edges in the tree, and the bytes taken by the tree and the dictionary.
+    def treeSize(self):
+        return len(self.tree), self.tree.numberOfEdges, self.tree.memoryUsage() + self.dictionary.memoryUsage()
+
     # This adds information into the MCTS database
 
     def printInformation(self):
         print(self.dictionary)
-        print(self.childrenMoveNames)
-        print(self.childrenStateSeen)
-        print(self.childrenStateWin)
-        print(self.childrenNNEvaluation)
-        print("Parent states in tree: ", len(self.childrenMoveNames))
+        for i in range(len(self.tree)):
+            print(self.tree.moveNames(i))
+            print(self.tree.seen(i))
+            print(self.tree.win(i))
+            print(self.tree.prior(i))
+        print("Parent states in tree: ", len(self.tree))
 
     def printSize(self):
-        print("Size: ", len(self.childrenMoveNames))
-
-    def addPositionToMCTS(self, string, legalMoves, arrayBoard, prediction):
-        self.dictionary[string] = len(self.dictionary)
-        self.childrenMoveNames.append(legalMoves)
-        self.childrenStateSeen.append(np.zeros(len(legalMoves)))
-        self.childrenStateWin.append(np.zeros(len(legalMoves)))
-
-        # should scale the evaluations from 0 to 1.
-        evaluations = ActionToArray.moveEvaluations(legalMoves, arrayBoard, prediction)
-        if len(evaluations) > 0:
-            minVal = np.amin(evaluations)  # pretend this is -2
-            maxVal = np.amax(evaluations)  # pretend this is 10
-            if minVal != maxVal:
-                multiplier = maxVal - minVal  # then multiplier is 12. max = 10/12, min = -2/12
-                try:
-                    center = minVal / multiplier
-                except ZeroDivisionError:
-                    center = 0
-                evaluations = (evaluations / multiplier)
-                evaluations = evaluations - center
-            else:
-                evaluations = evaluations / maxVal
-
-        self.childrenNNEvaluation.append(evaluations)
-
-        # NEED TO ADD ACTUALLY A PAWN
+        nodes, edges, memory = self.treeSize()
+        print("Size: ", nodes, "nodes,", edges, "edges,", round(memory / 2 ** 20, 2), "MB,", self.nodesEvicted,
+              "nodes evicted")
+
+    def addPositionToMCTS(self, key, pythonChessBoard, prediction):
+        moveIds, evaluations = legalMovePriors(pythonChessBoard, prediction)
+        self.dictionary[key] = self.tree.addNode(moveIds, evaluations, key, self.nodeNoise(len(moveIds)))
+
+    # the first n rows of a preallocated input tensor, which grows when a larger batch is needed.
+    def stateBuffer(self, n):
+        if self.states is None or len(self.states) < n:
+            self.states = torch.zeros((max(n, 8), 1, 112, 8), dtype=self.dtype)
+        return self.states[0:n]
+
+    # Runs the network on a batch of states (N, 1, 112, 8) and returns, for each of the python-chess boards they
+    # were encoded from, the move ids of its legal moves and their scaled evaluations, and the values of the
+    # positions (None if the network has no value head).
+    def evaluate(self, states, pythonChessBoards):
+        start = time.time()
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.autocast):
+            outputs, values = ChessConvNet.splitOutputs(self.neuralNet(states))
+            outputs = outputs.float().numpy()
+            if values is not None:
+                values = values.float().numpy()
+        if self.timingHook is not None:
+            self.timingHook(len(states), time.time() - start)
+        return [legalMovePriors(pythonChessBoards[i], outputs[i]) for i in range(len(pythonChessBoards))], values
+
+    # the noise of a new node with n moves, none with Dirichlet noise.
+    def nodeNoise(self, n):
+        if self.dirichletAlpha is not None:
+            return 0
+        return unitNoise(n, self.rng)
+
+    # the edge of the tree that PUCT prefers at the position. The noise on the evaluations was drawn when the node
+    # was added, and only its size depends on the plies. With Dirichlet noise, only the root of the search is noisy.
+    def chooseEdge(self, position, plies, explorationConstant, noise):
+        tree = self.tree
+        directory = self.dictionary[position]
+        tree.nodeVisited[directory] = tree.clock
+        start, end = tree.edgeOffset[directory], tree.edgeOffset[directory + 1]
+
+        evaluations = tree.edgePrior[start:end]
+        if noise:
+            if self.dirichletAlpha is None:
+                evaluations = evaluations + (0.6 / (2.5 * (1 + plies))) * tree.edgeNoise[start:end]
+            elif position == self.rootPosition:
+                evaluations = self.rootEvaluations(directory)
+        index = np.argmax(PUCT_Algorithm(tree.edgeWin[start:end], tree.edgeSeen[start:end], explorationConstant,
+                                         tree.nodeSeen[directory], evaluations))
+        return start + index
+
+    # evaluates the positions in one forward pass of the network and adds them to the tree. Returns their values,
+    # as evaluate.
+    def expandPositions(self, environments):
+        if len(environments) == 0:
+            return None
+        states = self.stateBuffer(len(environments))
+        boardsToStates(environments, out=states.numpy())
+        priors, values = self.evaluate(states, [environment.board for environment in environments])
+        for i in range(len(environments)):
+            key = environments[i].zobristHash
+            self.dictionary[key] = self.tree.addNode(*priors[i], key, self.nodeNoise(len(priors[i][0])))
+        return values
 
     def playout(self, round,
                 explorationConstant=0.15,  # lower? will test more.
-                notFromBeginning=False, arrayBoard=0, pythonBoard=0, plies=0, wCap=0, bCap=0,
-                actuallyAPawn=0,
+                notFromBeginning=False, pythonBoard=0, plies=0,
                 noise=True,
                 printPGN=True):  # Here is the information just for starting at a different position
 
@@ -146,91 +315,33 @@ class MCTS():
             PGN.headers["Black"] = "Network: " + self.nameOfNetwork
             PGN.headers["Variant"] = "Crazyhouse"
 
-        whiteParentStateDictionary = []
-        whiteStateSeen = []
-        whiteStateWin = []
-
-        blackParentStateDictionary = []
-        blackStateSeen = []
-        blackStateWin = []
+        # the edges of the tree chosen by each side.
+        whiteEdges = []
+        blackEdges = []
+        edge = -1
+        self.tree.clock += 1
 
         tempBoard = ChessEnvironment()
         if notFromBeginning:
-            tempBoard.arrayBoard = arrayBoard
-            tempBoard.board = pythonBoard
-            tempBoard.plies = plies
-            tempBoard.whiteCaptivePieces = wCap
-            tempBoard.blackCaptivePieces = bCap
-            tempBoard.actuallyAPawn = actuallyAPawn
-            tempBoard.updateNumpyBoards()
+            # the array board, captive pieces and promoted pieces are all read from the python-chess board.
+            tempBoard.setBoard(pythonBoard, plies)
+        startPosition = tempBoard.zobristHash
 
         while tempBoard.result == 2:
 
-            position = tempBoard.boardToString()
+            position = tempBoard.zobristHash
             if position not in self.dictionary:
                 # Create a new entry in the tree, if the state is not seen before.
-                state = torch.from_numpy(tempBoard.boardToState())
-                nullAction = torch.from_numpy(np.zeros((1, 4504)))  # this will not be used, is only a filler
-                testSet = MyDataset(state, nullAction)
-                generatePredic = torch.utils.data.DataLoader(dataset=testSet, batch_size=len(state), shuffle=False)
-                with torch.no_grad():
-                    for images, labels in generatePredic:
-                        outputs = self.neuralNet(images)
-                        self.addPositionToMCTS(tempBoard.boardToString(),
-                                               ActionToArray.legalMovesForState(tempBoard.arrayBoard,
-                                                                                tempBoard.board),
-                                               tempBoard.arrayBoard, outputs)
-                        # find and make the preferred move
-                        if noise:
-                            noiseConstant = 0.6 / (2.5 * (1 + tempBoard.plies))
-                        else:
-                            noiseConstant = 0
-
-                        if len(self.childrenStateWin) > 0:
-                            index = np.argmax(PUCT_Algorithm(self.childrenStateWin[len(self.childrenStateSeen) - 1],
-                                                             self.childrenStateSeen[len(self.childrenStateSeen) - 1],
-                                                             explorationConstant,
-                                                             np.sum(self.childrenStateSeen[
-                                                                        len(self.childrenStateSeen) - 1]),
-                                                             noiseEvals(self.childrenNNEvaluation[
-                                                                            len(self.childrenStateSeen) - 1],
-                                                                        noiseConstant)))
-                        else:
-                            index = 0
-
-                        move = self.childrenMoveNames[len(self.childrenStateSeen) - 1][index]
-
-                        if chess.Move.from_uci(move) not in tempBoard.board.legal_moves:
-                            print("Not legal move.")
-                            # play a random move
-                            move = self.childrenMoveNames[len(self.childrenStateSeen) - 1][0]
-
-                        # print(move)
-                        tempBoard.makeMove(move)
-
-                        actionVector = np.zeros(len(self.childrenMoveNames[len(self.childrenStateSeen) - 1]))
-                        actionVector[index] = 1
-            else:
-                # find the directory of the move
-                directory = self.dictionary[position]
-
-                if noise:
-                    noiseConstant = 0.6 / (2.5 * (1 + tempBoard.plies))
-                else:
-                    noiseConstant = 0
-                index = np.argmax(PUCT_Algorithm(self.childrenStateWin[directory],
-                                                 self.childrenStateSeen[directory], explorationConstant,
-                                                 np.sum(self.childrenStateSeen[directory]),
-                                                 noiseEvals(self.childrenNNEvaluation[directory], noiseConstant)
-                                                 ))
-                move = self.childrenMoveNames[directory][index]
+                self.expandPositions([tempBoard])
+            if edge != -1:
+                self.tree.edgeChild[edge] = self.dictionary[position]
 
-                # print(move)
-                tempBoard.makeMove(move)
+            # find and make the preferred move
+            edge = self.chooseEdge(position, tempBoard.plies, explorationConstant, noise)
+            move = self.tree.moveName(edge)
 
-                # the move will have to be indexed correctly based on where the position is.
-                actionVector = np.zeros(len(self.childrenMoveNames[directory]))
-                actionVector[index] = 1
+            # print(move)
+            tempBoard.makeMove(move)
 
             if printPGN:
                 if tempBoard.plies == 1:
@@ -240,36 +351,25 @@ class MCTS():
 
             # add this into the actions chosen.
             if tempBoard.plies % 2 == 1:  # white has moved.
-                whiteParentStateDictionary.append(position)
-                whiteStateSeen.append(actionVector)
+                whiteEdges.append(edge)
             else:  # black has moved
-                blackParentStateDictionary.append(position)
-                blackStateSeen.append(actionVector)
+                blackEdges.append(edge)
 
             # print(tempBoard.board)
             tempBoard.gameResult()
 
         if tempBoard.result == 1:  # white victory
-            for i in range(len(whiteStateSeen)):
-                whiteStateWin.append(whiteStateSeen[i])
-            for j in range(len(blackStateSeen)):
-                blackStateWin.append(blackStateSeen[j] * 0)
+            whiteWin, blackWin = 1, 0
             if printPGN:
                 PGN.headers["Result"] = "1-0"
         if tempBoard.result == -1:  # black victory
-            for i in range(len(whiteStateSeen)):
-                whiteStateWin.append(whiteStateSeen[i] * 0)
-            for j in range(len(blackStateSeen)):
-                blackStateWin.append(blackStateSeen[j])
-                # this is okay, because if the game is played til checkmate then
-                # this ensures that the move count for both sides is equal.
+            whiteWin, blackWin = 0, 1
+            # this is okay, because if the game is played til checkmate then
+            # this ensures that the move count for both sides is equal.
             if printPGN:
                 PGN.headers["Result"] = "0-1"
         if tempBoard.result == 0:  # 'tis a tie
-            for i in range(len(whiteStateSeen)):
-                whiteStateWin.append(whiteStateSeen[i] * 0.5)
-            for j in range(len(blackStateSeen)):
-                blackStateWin.append(blackStateSeen[j] * 0.5)
+            whiteWin, blackWin = 0.5, 0.5
             if printPGN:
                 PGN.headers["Result"] = "1/2-1/2"
 
@@ -278,20 +378,93 @@ class MCTS():
             print("PGN: ")
             print(PGN)
 
-        # now, add the information into the MCTS database.
-        for i in range(len(whiteStateSeen)):
-            directory = self.dictionary[whiteParentStateDictionary[i]]
-            self.childrenStateSeen[directory] = self.childrenStateSeen[directory] + whiteStateSeen[i]
-            self.childrenStateWin[directory] = self.childrenStateWin[directory] + whiteStateWin[i]
-        for i in range(len(blackStateSeen)):
-            directory = self.dictionary[blackParentStateDictionary[i]]
-            self.childrenStateSeen[directory] = self.childrenStateSeen[directory] + blackStateSeen[i]
-            self.childrenStateWin[directory] = self.childrenStateWin[directory] + blackStateWin[i]
+        # now, add the information into the MCTS database. np.add.at also counts an edge chosen twice (repetitions).
+        self.tree.addVisits(whiteEdges, 1, whiteWin)
+        self.tree.addVisits(blackEdges, 1, blackWin)
+        self.enforceBudget(startPosition)
 
         if printPGN:
             print(tempBoard.board)
             self.printSize()
 
+    # Runs batchSize playouts in lockstep. Each playout walks down the tree until it reaches a position that is not
+    # in the tree yet and waits there; the waiting positions (each only once) are then evaluated by the network in a
+    # single forward pass, instead of one pass per position.
+    # Every edge chosen counts as virtualLoss lost visits until the playouts are over, so that the playouts of the
+    # same batch spread over different moves. Returns the number of positions added to the tree.
+    # A playout waiting at a new position links the edge it came through once the position is in the tree, when it
+    # continues.
+    # With leafEvaluation (which defaults to that of the MCTS), every playout ends at the first new position instead,
+    # and each side's edges are credited with that side's share of the value of the position, so one forward pass
+    # makes a whole batch of playouts.
+    def playoutBatch(self, batchSize=8,
+                     explorationConstant=0.15,
+                     notFromBeginning=False, pythonBoard=0, plies=0,
+                     noise=True, virtualLoss=1, leafEvaluation=None):
+        if leafEvaluation is None:
+            leafEvaluation = self.leafEvaluation
+
+        startBoard = ChessEnvironment()
+        if notFromBeginning:
+            startBoard.setBoard(pythonBoard, plies)
+        boards = [startBoard.copy() for i in range(batchSize)]
+        whiteEdges = [[] for i in range(batchSize)]
+        blackEdges = [[] for i in range(batchSize)]
+        lastEdges = [-1] * batchSize
+        leafValues = [None] * batchSize  # value of the last position for the side to move there.
+        nodesBefore = len(self.tree)
+        self.tree.clock += 1
+
+        running = list(range(batchSize))
+        while len(running) > 0:
+            waiting = {}
+            for i in running:
+                tempBoard = boards[i]
+                while tempBoard.result == 2 and tempBoard.zobristHash in self.dictionary:
+                    if lastEdges[i] != -1:
+                        self.tree.edgeChild[lastEdges[i]] = self.dictionary[tempBoard.zobristHash]
+                    edge = self.chooseEdge(tempBoard.zobristHash, tempBoard.plies, explorationConstant, noise)
+                    lastEdges[i] = edge
+                    self.tree.edgeSeen[edge] += virtualLoss
+                    self.tree.nodeSeen[self.tree.edgeParent[edge]] += virtualLoss
+                    tempBoard.makeMove(self.tree.moveName(edge))
+                    if tempBoard.plies % 2 == 1:  # white has moved.
+                        whiteEdges[i].append(edge)
+                    else:  # black has moved
+                        blackEdges[i].append(edge)
+                    tempBoard.gameResult()
+                if tempBoard.result == 2:
+                    waiting[tempBoard.zobristHash] = tempBoard
+            values = self.expandPositions(list(waiting.values()))
+            if leafEvaluation:
+                if values is None and len(waiting) > 0:
+                    raise ValueError("leafEvaluation needs a network with a value head")
+                leafRows = {position: row for row, position in enumerate(waiting)}
+                for i in running:
+                    if boards[i].result == 2:
+                        leafValues[i] = float(values[leafRows[boards[i].zobristHash]])
+                        # the playout stops here, so link the new node now rather than on the next pass through it.
+                        if lastEdges[i] != -1:
+                            self.tree.edgeChild[lastEdges[i]] = self.dictionary[boards[i].zobristHash]
+                running = []
+            else:
+                running = [i for i in running if boards[i].result == 2]
+
+        # take the virtual loss back out and add the results.
+        for i in range(batchSize):
+            if leafValues[i] is None:
+                whiteWin, blackWin = RESULT_SCORES[boards[i].result]
+            elif boards[i].board.turn == chess.WHITE:
+                whiteWin, blackWin = leafValues[i], 1 - leafValues[i]
+            else:
+                whiteWin, blackWin = 1 - leafValues[i], leafValues[i]
+            self.tree.addVisits(whiteEdges[i], 1 - virtualLoss, whiteWin)
+            self.tree.addVisits(blackEdges[i], 1 - virtualLoss, blackWin)
+
+        newNodes = len(self.tree) - nodesBefore
+        self.enforceBudget(startBoard.zobristHash)
+        return newNodes
+
     def trainingPlayoutFromBeginning(self, runs, printPGN):
         for i in range(1, runs + 1):
             print("GAME", str(i))
@@ -302,35 +475,44 @@ class MCTS():
             print("GAME", str(i))
             self.playout(str(i), noise=False, printPGN=printPGN)
 
-    def trainingPlayoutsFromPosition(self, runs, sim):
+    # with batchSize above 1 or leafEvaluation, the playouts are run batchSize at a time by playoutBatch.
+    def trainingPlayoutsFromPosition(self, runs, sim, batchSize=1):
+        self.startSearch(sim)
+        if batchSize > 1 or self.leafEvaluation:
+            for i in range(0, runs, batchSize):
+                self.playoutBatch(min(batchSize, runs - i), notFromBeginning=True, pythonBoard=sim.board,
+                                  plies=sim.plies, noise=True, explorationConstant=0.3)
+            return
         for i in range(runs):
-            tempBoard = copy.deepcopy(sim)
+            tempBoard = sim.copy()
             # playout from a certain position.
-            self.playout(str(int(i + 1)), notFromBeginning=True, arrayBoard=tempBoard.arrayBoard,
-                         pythonBoard=tempBoard.board,
-                         plies=tempBoard.plies, wCap=tempBoard.whiteCaptivePieces, noise=True,
-                         bCap=tempBoard.blackCaptivePieces, actuallyAPawn=tempBoard.actuallyAPawn,
+            self.playout(str(int(i + 1)), notFromBeginning=True, pythonBoard=tempBoard.board,
+                         plies=tempBoard.plies, noise=True,
                          explorationConstant=0.3, printPGN=False)
 
             # self.printSize()
-            # print(self.childrenMoveNames[self.dictionary[sim.boardToString()]])
-            # print(self.childrenStateSeen[self.dictionary[sim.boardToString()]])
+            # print(self.tree.moveNames(self.dictionary[sim.zobristHash]))
+            # print(self.tree.seen(self.dictionary[sim.zobristHash]))
 
     def competitivePlayoutsFromPosition(self, runs, sim):
         for i in range(runs):
-            tempBoard = copy.deepcopy(sim)
+            tempBoard = sim.copy()
             # playout from a certain position.
-            self.playout(str(int(i + 1)), notFromBeginning=True, arrayBoard=tempBoard.arrayBoard,
-                         pythonBoard=tempBoard.board,
-                         plies=tempBoard.plies, wCap=tempBoard.whiteCaptivePieces, explorationConstant=0.3,
-                         bCap=tempBoard.blackCaptivePieces, noise=False, actuallyAPawn=tempBoard.actuallyAPawn,
-                         printPGN=False)
+            if self.leafEvaluation:
+                self.playoutBatch(1, notFromBeginning=True, pythonBoard=tempBoard.board, plies=tempBoard.plies,
+                                  explorationConstant=0.3, noise=False)
+            else:
+                self.playout(str(int(i + 1)), notFromBeginning=True, pythonBoard=tempBoard.board,
+                             plies=tempBoard.plies, explorationConstant=0.3, noise=False,
+                             printPGN=False)
 
             # self.printSize()
-            print(self.childrenMoveNames[self.dictionary[sim.boardToString()]])
-            print(self.childrenStateSeen[self.dictionary[sim.boardToString()]])
+            print(self.tree.moveNames(self.dictionary[sim.zobristHash]))
+            print(self.tree.seen(self.dictionary[sim.zobristHash]))
 
-    def simulateTrainingGame(self, playouts, round="1"):
+    # with reuseTree, the tree is cut down to the position after every move (see pruneTree), so the playouts of the
+    # next move start from the statistics gathered under it and the rest of the tree is freed.
+    def simulateTrainingGame(self, playouts, round="1", batchSize=1, printPGN=True, reuseTree=False):
 
         PGN = chess.pgn.Game()
         PGN.headers["Event"] = "Simulated Training Game"
@@ -341,52 +523,55 @@ class MCTS():
         PGN.headers["Black"] = "Network: " + self.nameOfNetwork
         PGN.headers["Variant"] = "Crazyhouse"
 
-        whiteParentState = np.zeros(1)
+        # board records of the positions, encoded all at once when the game is over.
+        whiteParentRecords = []
         whiteStateSeen = []
         whiteStateWin = []
         whiteStateNames = []
 
-        blackParentState = np.zeros(1)
+        blackParentRecords = []
         blackStateSeen = []
         blackStateWin = []
         blackStateNames = []
 
         sim = ChessEnvironment()
         while sim.result == 2:
-            self.trainingPlayoutsFromPosition(playouts, sim)
-            directory = self.dictionary[sim.boardToString()]
+            self.trainingPlayoutsFromPosition(playouts, sim, batchSize)
+            directory = self.dictionary[sim.zobristHash]
+            if self.dirichletAlpha is None:
+                evaluations = noiseEvals(self.tree.prior(directory), 1.35 / (6 * ((sim.plies // 2) + 1)), self.rng)
+            else:
+                evaluations = self.rootEvaluations(directory)
             index = np.argmax(
-                PUCT_Algorithm(self.childrenStateWin[directory], self.childrenStateSeen[directory], 0.22,
+                PUCT_Algorithm(self.tree.win(directory), self.tree.seen(directory), 0.22,
                                # 0.25-0.30 guarantees diversity
-                               np.sum(self.childrenStateSeen[directory]),
-                               noiseEvals(self.childrenNNEvaluation[directory], 1.35 / (6 * ((sim.plies // 2) + 1))))
+                               self.tree.nodeSeen[directory],
+                               evaluations)
             )
-            move = self.childrenMoveNames[directory][index]
-            moveNames = self.childrenMoveNames[directory]
+            moveNames = self.tree.moveNames(directory)
+            move = moveNames[index]
 
-            actionVector = np.zeros(len(self.childrenMoveNames[directory]))
+            actionVector = np.zeros(len(moveNames))
             actionVector[index] = 1
 
-            if sim.plies == 0:
-                whiteParentState = sim.boardToState()
+            if sim.plies % 2 == 0:
+                whiteParentRecords.append(sim.toRecord())
                 whiteStateSeen.append(actionVector)
                 whiteStateNames.append(moveNames)
-            if sim.plies == 1:
-                blackParentState = sim.boardToState()
-                blackStateSeen.append(actionVector)
-                blackStateNames.append(moveNames)
-            if sim.plies % 2 == 0 and sim.plies != 0:
-                whiteParentState = np.concatenate((whiteParentState, sim.boardToState()))
-                whiteStateSeen.append(actionVector)
-                whiteStateNames.append(moveNames)
-            if sim.plies % 2 == 1 and sim.plies != 1:
-                blackParentState = np.concatenate((blackParentState, sim.boardToState()))
+            else:
+                blackParentRecords.append(sim.toRecord())
                 blackStateSeen.append(actionVector)
                 blackStateNames.append(moveNames)
 
             sim.makeMove(move)
             sim.gameResult()
-            print(sim.board)
+            if reuseTree:
+                kept, freed = self.pruneTree(sim.zobristHash)
+                if printPGN:
+                    print("Tree reused:", kept, "nodes kept,", freed, "freed.")
+            if printPGN:
+                print(sim.board)
+                self.printSize()
 
             if sim.plies == 1:
                 node = PGN.add_variation(chess.Move.from_uci(move))
@@ -417,16 +602,17 @@ class MCTS():
             for j in range(len(blackStateSeen)):
                 blackStateWin.append(blackStateSeen[j] * 1)
 
-        parentStates = np.concatenate((whiteParentState, blackParentState))
+        parentStates = recordsToStates(whiteParentRecords + blackParentRecords)
         statesSeen = whiteStateSeen + blackStateSeen
         statesWin = whiteStateWin + blackStateWin
         statesNames = whiteStateNames + blackStateNames
 
-        print(PGN)
+        if printPGN:
+            print(PGN)
 
         return parentStates, statesSeen, statesWin, statesNames
 
-    def simulateCompetitiveGame(self, playouts):
+    def simulateCompetitiveGame(self, playouts, reuseTree=False):
 
         PGN = chess.pgn.Game()
         PGN.headers["Event"] = "Simulated Competitive Game"
@@ -438,30 +624,26 @@ class MCTS():
         PGN.headers["Variant"] = "Crazyhouse"
 
         # refresh the MCTS tree from scratch initially.
-
-        self.dictionary = {
-            # 'string' = n position. Let this string be the FEN of the position.
-        }
-        self.childrenMoveNames = []  # a 2D list, each directory may be of different size, stores name of moves
-        self.childrenStateSeen = []  # a 2D list, each directory contains numpy array
-        self.childrenStateWin = []  # a 2D list, each directory contains numpy array
-        self.childrenNNEvaluation = []  # a 2D list, each directory contains numpy array
+        self.resetTree()
 
         sim = ChessEnvironment()
         while sim.result == 2:
 
             # now start looking at variations
             self.competitivePlayoutsFromPosition(playouts, sim)
-            directory = self.dictionary[sim.boardToString()]
+            directory = self.dictionary[sim.zobristHash]
             index = np.argmax(
-                PUCT_Algorithm(self.childrenStateWin[directory], self.childrenStateSeen[directory], 0,
-                               np.sum(self.childrenStateSeen[directory]),
-                               self.childrenNNEvaluation[directory])
+                PUCT_Algorithm(self.tree.win(directory), self.tree.seen(directory), 0,
+                               self.tree.nodeSeen[directory],
+                               self.tree.prior(directory))
             )
-            move = self.childrenMoveNames[directory][index]
+            move = self.tree.moveNames(directory)[index]
             print(move)
             sim.makeMove(move)
             sim.gameResult()
+            if reuseTree:
+                kept, freed = self.pruneTree(sim.zobristHash)
+                print("Tree reused:", kept, "nodes kept,", freed, "freed.")
 
             if sim.plies == 1:
                 node = PGN.add_variation(chess.Move.from_uci(move))
@@ -479,133 +661,61 @@ class MCTS():
 
         print(PGN)
 
-    def createTrainingGames(self, numberOfGames, playouts):
-        trainingParentStates = np.zeros(1)
-        trainingStatesSeen = []
-        trainingStatesWin = []
-        trainingStatesName = []
-        trainingWinPercentages = []
-
+    def createTrainingGames(self, numberOfGames, playouts, batchSize=1, reuseTree=False):
+        games = []
         for i in range(numberOfGames):
-            newParentStates, \
-            newStatesSeen, \
-            newStatesWin, \
-            newStatesName = self.simulateTrainingGame(playouts, round=str(int(i + 1)))
-
-            if i == 0:  # if nothing has been added yet
-                trainingParentStates = newParentStates
-                trainingStatesSeen = newStatesSeen
-                trainingStatesWin = newStatesWin
-                trainingStatesName = newStatesName
-
-            if i != 0:
-                removeDirectories = []
-                for k in range(len(trainingParentStates)):
-                    for j in range(len(newParentStates)):
-                        if np.sum((abs(trainingParentStates[k].flatten() - newParentStates[j].flatten()))) == 0:
-                            # If information is already in dataset, edit existing data
-                            trainingStatesWin[k] = trainingStatesWin[k] + newStatesWin[j]
-                            trainingStatesSeen[k] = trainingStatesSeen[k] + newStatesSeen[j]
-                            removeDirectories.append(j)
-                removeDirectories.sort()
-                while len(removeDirectories) > 0:
-                    index = removeDirectories.pop()
-                    newParentStates = np.delete(newParentStates, index, axis=0)
-                    del newStatesSeen[index]
-                    del newStatesWin[index]
-                    del newStatesName[index]
-
-                trainingParentStates = np.concatenate((trainingParentStates, newParentStates), axis=0)
-                trainingStatesSeen = trainingStatesSeen + newStatesSeen
-                trainingStatesWin = trainingStatesWin + newStatesWin
-                trainingStatesName = trainingStatesName + newStatesName
-        # Create win percentage for all moves:
-        for j in range(len(trainingStatesWin)):  # length of tSW and tSS should be the same
-            newEntry = np.divide(trainingStatesWin[j], trainingStatesSeen[j], out=np.zeros_like(trainingStatesWin[j]),
-                                 where=trainingStatesSeen[j] != 0)
-            trainingWinPercentages.append(newEntry)
-
-        # return the information. trainingWinPercentages has to be converted to a numpy array of correct shape!
-        print("Size of Training Material: ", len(trainingParentStates))
-        print(len(trainingWinPercentages))
-        print(len(trainingStatesName))
-        print(len(trainingParentStates))
-        print(trainingParentStates.shape)
-
-        # now, for each trainingWinPercentages and trainingStatesName, convert this into an output that the NN can train on.
-
-        trainingParentActions = np.zeros(1)
-
-        # create output for nn
-        for k in range(len(trainingStatesWin)):
-            actionTaken = np.zeros((1, 4504))
-            # find the board position when move was played.
-            blankBoard = [[" ", " ", " ", " ", " ", " ", " ", " "],  # 0 - 7
-                          [" ", " ", " ", " ", " ", " ", " ", " "],  # 8 - 15
-                          [" ", " ", " ", " ", " ", " ", " ", " "],  # 16 - 23
-                          [" ", " ", " ", " ", " ", " ", " ", " "],  # 24 - 31
-                          [" ", " ", " ", " ", " ", " ", " ", " "],  # 32 - 39
-                          [" ", " ", " ", " ", " ", " ", " ", " "],  # 40 - 47
-                          [" ", " ", " ", " ", " ", " ", " ", " "],  # 48 - 55
-                          [" ", " ", " ", " ", " ", " ", " ", " "]]  # 56 - 63
-            for i in range(64):
-                pieces = "PNBRQKpnbrqk"
-                for j in range(len(pieces)):
-                    if trainingParentStates[k].flatten()[(j*64)+i] == 1:
-                        blankBoard[i//8][i % 8] = pieces[j]
-
-            # this is the board.
-            #print(blankBoard)
-            # this is the move chosen
-            #print(trainingStatesName[k][np.argmax(trainingStatesSeen[k])])
-
-            for l in range(len(trainingStatesName[k])):
-                if l == 0:
-                    actionTaken = ActionToArray.moveArray(trainingStatesName[k][l], blankBoard) * trainingStatesWin[k][l]
-                else:
-                    additionalAction = ActionToArray.moveArray(trainingStatesName[k][l], blankBoard) * trainingStatesWin[k][l]
-                    actionTaken = actionTaken + additionalAction
+            games.append(self.simulateTrainingGame(playouts, round=str(int(i + 1)), batchSize=batchSize,
+                                                   reuseTree=reuseTree))
+        return trainingDataFromGames(games)
 
-            if k == 0:
-                trainingParentActions = actionTaken
-            else:
-                trainingParentActions = np.concatenate((trainingParentActions, actionTaken), axis=0)
 
-        #print(np.sum(trainingParentActions, axis=1))
+# Merges the games returned by simulateTrainingGame into the states and move arrays the network trains on.
+# Positions seen more than once are kept once, with their visits and wins added up (see PositionAccumulator).
+def trainingDataFromGames(games):
+    accumulator = PositionAccumulator()
+    for game in games:
+        accumulator.addGame(*game)
+
+    trainingParentStates = accumulator.parentStates()
+    print("Size of Training Material: ", len(trainingParentStates))
+    print(trainingParentStates.shape)
 
-        return trainingParentStates, trainingParentActions
+    # the win counts of the moves of each position, as outputs that the NN can train on.
+    trainingParentActions = accumulator.parentActions()
 
+    return trainingParentStates, trainingParentActions
 
 
-# Initialize board and the MCTS.
+if __name__ == "__main__":
+    # Initialize board and the MCTS.
 
-treeSearch = MCTS('supervised.pt')
-'''
+    treeSearch = MCTS('supervised.pt')
+    '''
 
-PLAYOUTS = 10
-start = time.time()
-treeSearch.competitivePlayoutFromBeginning(PLAYOUTS, True)
-end = time.time()
+    PLAYOUTS = 10
+    start = time.time()
+    treeSearch.competitivePlayoutFromBeginning(PLAYOUTS, True)
+    end = time.time()
 
-print("\nStatistics:")
-print(end-start, "seconds elapsed.")
-print("Average time for a game", (end-start)/PLAYOUTS, "seconds.")
-'''
+    print("\nStatistics:")
+    print(end-start, "seconds elapsed.")
+    print("Average time for a game", (end-start)/PLAYOUTS, "seconds.")
+    '''
 
-newBoard = ChessEnvironment()
+    newBoard = ChessEnvironment()
 
-blah = np.load("selfPlay01Output.npy")
-print(blah.shape)
+    blah = np.load("selfPlay01Output.npy")
+    print(blah.shape)
 
-#selfPlayInput, selfPlayOutput = treeSearch.createTrainingGames(20, 1)
-#np.save("selfPlay01Input.npy", selfPlayInput)
-#np.save("selfPlay01Output.npy", selfPlayOutput)
+    #selfPlayInput, selfPlayOutput = treeSearch.createTrainingGames(20, 1)
+    #np.save("selfPlay01Input.npy", selfPlayInput)
+    #np.save("selfPlay01Output.npy", selfPlayOutput)
 
-treeSearch.printSize()
+    treeSearch.printSize()
 
-# in the future, the number of playouts at a position can be dependent on how many possible moves there are
-# this way, resources are allocated and used when most necessary.
+    # in the future, the number of playouts at a position can be dependent on how many possible moves there are
+    # this way, resources are allocated and used when most necessary.
 
-# Important: make sure that after the entire data matrix for training is complete,
-# multiply the pick up plane (entries from square 320 to 383) by 2.
-# This allows training to increase in speed.
+    # Important: make sure that after the entire data matrix for training is complete,
+    # multiply the pick up plane (entries from square 320 to 383) by 2.
+    # This allows training to increase in speed.
@@ -1,15 +1,138 @@
 import torch.utils.data as data_utils
 import torch.nn as nn
 import torch
+import numpy as np
+import zlib
+from ChessEnvironment import RECORD_LEN, recordsToStates
+from ReplayBuffer import ReplayBuffer
 
+# values, when given, are the targets of the value head, and make each item (input, output, value).
 class MyDataset(torch.utils.data.Dataset):
 
-    def __init__(self, inputs, outputs):
+    def __init__(self, inputs, outputs, values=None):
         self.features = inputs
         self.targets = outputs
+        self.values = values
 
     def __getitem__(self, index):
+        if self.values is not None:
+            return self.features[index], self.targets[index], self.values[index]
         return self.features[index], self.targets[index]
 
     def __len__(self):
         return len(self.features)
+
+
+# Positions with sparse move array targets: the target of position k holds weights[offsets[k]:offsets[k + 1]] at
+# indices[offsets[k]:offsets[k + 1]] (see ActionToArray.denseActions). inputs are either states or board records,
+# which are only encoded once they are in a batch. Use collate as the collate_fn of the DataLoader: a batch is the
+# states and the targets as (rows, columns, values) of their nonzero entries, followed by the targets of the value
+# head if positionValues are given.
+class SparseDataset(torch.utils.data.Dataset):
+
+    def __init__(self, inputs, offsets, indices, weights, dtype=np.float32, positionValues=None):
+        self.inputs = inputs
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.indices = indices
+        self.weights = weights
+        self.dtype = dtype
+        self.positionValues = positionValues
+        self.records = inputs.dtype == np.uint8 and inputs.shape[-1] == RECORD_LEN
+
+    def __getitem__(self, index):
+        return index
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def collate(self, batch):
+        positions = np.asarray(batch, dtype=np.int64)
+        if self.records:
+            states = recordsToStates(self.inputs[positions], dtype=self.dtype)
+        else:
+            states = np.asarray(self.inputs[positions], dtype=self.dtype)
+
+        starts = self.offsets[positions]
+        counts = self.offsets[positions + 1] - starts
+        rows = np.repeat(np.arange(len(positions)), counts)
+        entries = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        columns = np.asarray(self.indices[entries], dtype=np.int64)
+        values = np.asarray(self.weights[entries], dtype=self.dtype)
+        targets = (torch.from_numpy(rows), torch.from_numpy(columns), torch.from_numpy(values))
+        if self.positionValues is not None:
+            return torch.from_numpy(states), targets, torch.from_numpy(
+                np.asarray(self.positionValues[positions], dtype=self.dtype))
+        return torch.from_numpy(states), targets
+
+
+# Builds a batch from (record, target indices, target weights, value) items, in the same form as
+# SparseDataset.collate with the values of the positions.
+def collateRecords(items, dtype=np.float32):
+    states = recordsToStates(np.stack([item[0] for item in items]), dtype=dtype)
+    lengths = [len(item[1]) for item in items]
+    rows = np.repeat(np.arange(len(items)), lengths)
+    columns = np.concatenate([item[1] for item in items]).astype(np.int64)
+    values = np.concatenate([item[2] for item in items]).astype(dtype)
+    positionValues = np.array([item[3] for item in items], dtype=dtype)
+    return torch.from_numpy(states), (torch.from_numpy(rows), torch.from_numpy(columns), torch.from_numpy(values)), \
+        torch.from_numpy(positionValues)
+
+
+# Streams the positions of a ReplayBuffer directory without loading it: chunks are memory mapped one at a time and
+# their positions pass through a shuffle buffer of shuffleBuffer positions. With several DataLoader workers, each
+# worker reads its own share of the chunks. Items are (record, target indices, target weights, value); use
+# collateRecords as the collate_fn. The chunks and their order are fixed when iteration starts, and setEpoch
+# changes the order between epochs.
+# validationFraction of the chunks (picked by a hash of their names, so the same chunks every time) are held out
+# for validation: they are left out of this dataset, and make up the dataset returned by heldOut.
+class ReplayDataset(torch.utils.data.IterableDataset):
+
+    def __init__(self, directory, shuffleBuffer=10000, seed=0, validationFraction=0, validation=False):
+        self.directory = directory
+        self.shuffleBuffer = shuffleBuffer
+        self.seed = seed
+        self.epoch = 0
+        self.validationFraction = validationFraction
+        self.validation = validation
+
+    def setEpoch(self, epoch):
+        self.epoch = epoch
+
+    def heldOut(self):
+        return ReplayDataset(self.directory, self.shuffleBuffer, self.seed, self.validationFraction, True)
+
+    # the index lines of the chunks in this dataset.
+    def chunks(self):
+        return [chunk for chunk in ReplayBuffer(self.directory).chunks()
+                if (zlib.crc32(chunk["chunk"].encode()) % 1000 < self.validationFraction * 1000) == self.validation]
+
+    def __len__(self):
+        return sum(chunk["positions"] for chunk in self.chunks())
+
+    def __iter__(self):
+        replayBuffer = ReplayBuffer(self.directory)
+        chunks = [chunk["chunk"] for chunk in self.chunks()]
+        workerInfo = torch.utils.data.get_worker_info()
+        worker, workers = (0, 1) if workerInfo is None else (workerInfo.id, workerInfo.num_workers)
+        # every worker shuffles the chunks the same way, and then takes its share of them.
+        np.random.RandomState((self.seed * 1000003 + self.epoch) % (2 ** 32)).shuffle(chunks)
+        chunks = chunks[worker::workers]
+        randomState = np.random.RandomState((self.seed * 1000003 + self.epoch * 1009 + worker + 1) % (2 ** 32))
+
+        buffer = []
+        for chunk in chunks:
+            arrays = replayBuffer.readChunk(chunk)
+            records, offsets = np.asarray(arrays["records"]), np.asarray(arrays["offsets"])
+            indices, weights, values = np.asarray(arrays["indices"]), np.asarray(arrays["weights"]), arrays["values"]
+            for k in range(len(records)):
+                item = (records[k], indices[offsets[k]:offsets[k + 1]], weights[offsets[k]:offsets[k + 1]],
+                        float(values[k]))
+                if len(buffer) < self.shuffleBuffer:
+                    buffer.append(item)
+                else:
+                    replace = randomState.randint(self.shuffleBuffer)
+                    yield buffer[replace]
+                    buffer[replace] = item
+        randomState.shuffle(buffer)
+        for item in buffer:
+            yield item
@@ -0,0 +1,185 @@
+import numpy as np
+import ActionToArray
+
+
+# Tree statistics of the MCTS, stored as a struct of arrays. Every node owns a contiguous range of edges (one per
+# legal move), edgeOffset[node]:edgeOffset[node + 1], and each edge has a move id (see ActionToArray.MOVE_IDS),
+# a visit count, a win count and the neural network evaluation. The arrays grow geometrically and are updated in
+# place, so selection at a node is a slice of each array.
+# Each node also keeps the hash of its position (nodeKey), and each edge the node it was last seen to lead to
+# (edgeChild, -1 until a playout has gone through it and found the position in the tree), so that the part of the
+# tree under a position can be found and the rest dropped by compact. nodeVisited holds the value of clock when each
+# node was last visited, for evicting the least recently used nodes. When compact leaves less than a quarter of the
+# arrays in use, they are reallocated at twice the size in use (never below the capacities the store started with),
+# so that a pruned tree gives its memory back.
+# Visits are added through addVisits, which also keeps the total visits of every node (nodeSeen) up to date, so that
+# selection does not have to sum them. Every edge also keeps the node it belongs to (edgeParent) and a uniform number
+# in [-1, 1) drawn when its node was added (edgeNoise), which selection scales into noise on the evaluation.
+class NodeStore():
+
+    def __init__(self, nodeCapacity=1024, edgeCapacity=32768):
+        self.numberOfNodes = 0
+        self.numberOfEdges = 0
+        self.clock = 0
+        self.minimumCapacity = (nodeCapacity, edgeCapacity)
+        self.edgeOffset = np.zeros(nodeCapacity + 1, dtype=np.int64)
+        self.nodeKey = np.zeros(nodeCapacity, dtype=np.int64)
+        self.nodeVisited = np.zeros(nodeCapacity, dtype=np.int64)
+        self.nodeSeen = np.zeros(nodeCapacity, dtype=np.float32)
+        self.edgeMove = np.zeros(edgeCapacity, dtype=np.int16)
+        self.edgeSeen = np.zeros(edgeCapacity, dtype=np.float32)
+        self.edgeWin = np.zeros(edgeCapacity, dtype=np.float32)
+        self.edgePrior = np.zeros(edgeCapacity, dtype=np.float32)
+        self.edgeChild = np.full(edgeCapacity, -1, dtype=np.int64)
+        self.edgeParent = np.zeros(edgeCapacity, dtype=np.int64)
+        self.edgeNoise = np.zeros(edgeCapacity, dtype=np.float32)
+
+    def __len__(self):
+        return self.numberOfNodes
+
+    # adds a node with one edge per move id, and returns the index of the node.
+    def addNode(self, moveIds, priors, key=0, noise=0):
+        node = self.numberOfNodes
+        start = self.numberOfEdges
+        end = start + len(moveIds)
+        if node + 2 > len(self.edgeOffset):
+            self.edgeOffset = grow(self.edgeOffset, node + 2)
+        if node + 1 > len(self.nodeKey):
+            self.nodeKey = grow(self.nodeKey, node + 1)
+            self.nodeVisited = grow(self.nodeVisited, node + 1)
+            self.nodeSeen = grow(self.nodeSeen, node + 1)
+        if end > len(self.edgeMove):
+            self.edgeMove = grow(self.edgeMove, end)
+            self.edgeSeen = grow(self.edgeSeen, end)
+            self.edgeWin = grow(self.edgeWin, end)
+            self.edgePrior = grow(self.edgePrior, end)
+            self.edgeChild = grow(self.edgeChild, end)
+            self.edgeParent = grow(self.edgeParent, end)
+            self.edgeNoise = grow(self.edgeNoise, end)
+
+        self.edgeMove[start:end] = moveIds
+        self.edgeSeen[start:end] = 0
+        self.edgeWin[start:end] = 0
+        self.edgePrior[start:end] = priors
+        self.edgeChild[start:end] = -1
+        self.edgeParent[start:end] = node
+        self.edgeNoise[start:end] = noise
+        self.edgeOffset[node + 1] = end
+        self.nodeKey[node] = key
+        self.nodeVisited[node] = self.clock
+        self.nodeSeen[node] = 0
+        self.numberOfNodes = node + 1
+        self.numberOfEdges = end
+        return node
+
+    def edges(self, node):
+        return self.edgeOffset[node], self.edgeOffset[node + 1]
+
+    # the slices below are views, so adding to them updates the tree.
+    def seen(self, node):
+        return self.edgeSeen[self.edgeOffset[node]:self.edgeOffset[node + 1]]
+
+    def win(self, node):
+        return self.edgeWin[self.edgeOffset[node]:self.edgeOffset[node + 1]]
+
+    def prior(self, node):
+        return self.edgePrior[self.edgeOffset[node]:self.edgeOffset[node + 1]]
+
+    # adds seen visits and win wins to each of the edges (an edge given twice gets them twice), and the visits to the
+    # totals of their nodes.
+    def addVisits(self, edges, seen, win=0):
+        edges = np.asarray(edges, dtype=np.int64)
+        np.add.at(self.edgeSeen, edges, seen)
+        np.add.at(self.nodeSeen, self.edgeParent[edges], seen)
+        if win != 0:
+            np.add.at(self.edgeWin, edges, win)
+
+    # the number of visits of every node, over all its edges.
+    def visits(self):
+        return self.nodeSeen[0:self.numberOfNodes].copy()
+
+    def moveName(self, edge):
+        return ActionToArray.MOVE_NAMES[self.edgeMove[edge]]
+
+    def moveNames(self, node):
+        start, end = self.edges(node)
+        return [ActionToArray.MOVE_NAMES[moveId] for moveId in self.edgeMove[start:end].tolist()]
+
+    # the nodes that can be reached from root through the child links, in increasing order.
+    def reachable(self, root):
+        marked = np.zeros(self.numberOfNodes, dtype=bool)
+        marked[root] = True
+        frontier = np.array([root], dtype=np.int64)
+        while len(frontier) > 0:
+            starts = self.edgeOffset[frontier]
+            counts = self.edgeOffset[frontier + 1] - starts
+            edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(np.sum(counts))
+            children = self.edgeChild[edges]
+            children = np.unique(children[children != -1])
+            frontier = children[~marked[children]]
+            marked[frontier] = True
+        return np.nonzero(marked)[0]
+
+    # keeps only the given nodes (in increasing order) and their edges, moved to the front of the arrays in the same
+    # order. Child links to dropped nodes are cleared. Returns, for every old node, its new index or -1.
+    def compact(self, nodes):
+        newIndex = np.full(self.numberOfNodes, -1, dtype=np.int64)
+        newIndex[nodes] = np.arange(len(nodes))
+        starts = self.edgeOffset[nodes]
+        counts = self.edgeOffset[nodes + 1] - starts
+        newOffset = np.concatenate(([0], np.cumsum(counts)))
+        edges = np.repeat(starts - newOffset[0:-1], counts) + np.arange(newOffset[-1])
+
+        end = len(edges)
+        self.edgeMove[0:end] = self.edgeMove[edges]
+        self.edgeSeen[0:end] = self.edgeSeen[edges]
+        self.edgeWin[0:end] = self.edgeWin[edges]
+        self.edgePrior[0:end] = self.edgePrior[edges]
+        children = self.edgeChild[edges]
+        self.edgeChild[0:end] = np.where(children != -1, newIndex[children], -1)
+        self.edgeParent[0:end] = np.repeat(np.arange(len(nodes)), counts)
+        self.edgeNoise[0:end] = self.edgeNoise[edges]
+        self.nodeKey[0:len(nodes)] = self.nodeKey[nodes]
+        self.nodeVisited[0:len(nodes)] = self.nodeVisited[nodes]
+        self.nodeSeen[0:len(nodes)] = self.nodeSeen[nodes]
+        self.edgeOffset[0:len(nodes) + 1] = newOffset
+        self.numberOfNodes = len(nodes)
+        self.numberOfEdges = end
+        self.shrink()
+        return newIndex
+
+    # reallocates the node arrays and the edge arrays that are less than a quarter full.
+    def shrink(self):
+        nodeCapacity, edgeCapacity = self.minimumCapacity
+        if 4 * self.numberOfNodes < len(self.nodeKey) and len(self.nodeKey) > nodeCapacity:
+            nodeCapacity = max(nodeCapacity, 2 * self.numberOfNodes)
+            self.edgeOffset = resize(self.edgeOffset, nodeCapacity + 1)
+            self.nodeKey = resize(self.nodeKey, nodeCapacity)
+            self.nodeVisited = resize(self.nodeVisited, nodeCapacity)
+            self.nodeSeen = resize(self.nodeSeen, nodeCapacity)
+        if 4 * self.numberOfEdges < len(self.edgeMove) and len(self.edgeMove) > edgeCapacity:
+            edgeCapacity = max(edgeCapacity, 2 * self.numberOfEdges)
+            self.edgeMove = resize(self.edgeMove, edgeCapacity)
+            self.edgeSeen = resize(self.edgeSeen, edgeCapacity)
+            self.edgeWin = resize(self.edgeWin, edgeCapacity)
+            self.edgePrior = resize(self.edgePrior, edgeCapacity)
+            self.edgeChild = resize(self.edgeChild, edgeCapacity)
+            self.edgeParent = resize(self.edgeParent, edgeCapacity)
+            self.edgeNoise = resize(self.edgeNoise, edgeCapacity)
+
+    def memoryUsage(self):
+        return self.edgeOffset.nbytes + self.nodeKey.nbytes + self.nodeVisited.nbytes + self.nodeSeen.nbytes + \
+               self.edgeMove.nbytes + self.edgeSeen.nbytes + self.edgeWin.nbytes + self.edgePrior.nbytes + \
+               self.edgeChild.nbytes + self.edgeParent.nbytes + self.edgeNoise.nbytes
+
+
+# copies the array into one at least twice as large.
+def grow(array, required):
+    newArray = np.zeros(max(required, len(array) * 2), dtype=array.dtype)
+    newArray[0:len(array)] = array
+    return newArray
+
+
+# copies the start of the array into a smaller one of the given size.
+def resize(array, size):
+    return array[0:size].copy()
@@ -0,0 +1,87 @@
+import hashlib
+
+import numpy as np
+import ActionToArray
+from ChessEnvironment import recordsToStates, statesToRecords
+
+
+# Collects the positions of many self-play games, keeping each position once. Positions are kept as board records
+# (see ChessEnvironment.statesToRecords) and only turned back into states when the arrays are built. They are looked
+# up by a digest of the record together with the names of the legal moves (records do not hold castling rights, so
+# the same record can have different moves), and the visits and wins of a position seen again are added to its row
+# in place.
+class PositionAccumulator():
+
+    def __init__(self):
+        self.index = {}  # digest of the position = row
+        self.records = []
+        self.statesSeen = []
+        self.statesWin = []
+        self.statesNames = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def key(self, record, names):
+        digest = hashlib.blake2b(record.tobytes(), digest_size=16)
+        digest.update(" ".join(names).encode())
+        return digest.digest()
+
+    def add(self, record, seen, win, names):
+        key = self.key(record, names)
+        row = self.index.get(key)
+        if row is None:
+            self.index[key] = len(self.records)
+            self.records.append(record)
+            self.statesSeen.append(np.array(seen, dtype=np.float64))
+            self.statesWin.append(np.array(win, dtype=np.float64))
+            self.statesNames.append(names)
+        else:
+            self.statesSeen[row] += seen
+            self.statesWin[row] += win
+
+    # adds a game as returned by MCTS.simulateTrainingGame.
+    def addGame(self, parentStates, statesSeen, statesWin, statesNames):
+        records = statesToRecords(parentStates)
+        for i in range(len(records)):
+            self.add(records[i], statesSeen[i], statesWin[i], statesNames[i])
+
+    def parentRecords(self):
+        return np.stack(self.records)
+
+    def parentStates(self):
+        return recordsToStates(self.parentRecords())
+
+    # the move arrays the network trains on, in the sparse form of ActionToArray.denseActions: every move adds its
+    # wins to its entry of the array, and twice its wins to the pick up entry (see ActionToArray.moveArray).
+    def sparseActions(self):
+        offsets = np.zeros(len(self.records) + 1, dtype=np.int64)
+        indices = []
+        weights = []
+        for k in range(len(self.records)):
+            moveIds = np.array([ActionToArray.MOVE_IDS[name] for name in self.statesNames[k]], dtype=np.int64)
+            pickUps = ActionToArray.PICKUP_INDEX[moveIds]
+            rowIndices = np.concatenate((ActionToArray.MOVE_INDEX[moveIds], pickUps[pickUps != -1]))
+            rowWeights = np.concatenate((self.statesWin[k], 2 * self.statesWin[k][pickUps != -1]))
+            # moves from the same square share their pick up entry, and moves that never won are left out.
+            rowIndices, inverse = np.unique(rowIndices, return_inverse=True)
+            rowWeights = np.bincount(inverse, weights=rowWeights, minlength=len(rowIndices))
+            indices.append(rowIndices[rowWeights != 0])
+            weights.append(rowWeights[rowWeights != 0])
+            offsets[k + 1] = offsets[k] + len(indices[k])
+        if len(self.records) == 0:
+            return offsets, np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.float32)
+        return offsets, np.concatenate(indices).astype(np.int16), np.concatenate(weights).astype(np.float32)
+
+    def parentActions(self):
+        offsets, indices, weights = self.sparseActions()
+        return ActionToArray.denseActions(offsets, indices, weights)
+
+    # the share of points won from each position by the side to move, over all the times it was seen.
+    def values(self):
+        values = np.zeros(len(self.records), dtype=np.float32)
+        for k in range(len(self.records)):
+            seen = np.sum(self.statesSeen[k])
+            if seen != 0:
+                values[k] = np.sum(self.statesWin[k]) / seen
+        return values
@@ -0,0 +1,146 @@
+"""
+An int8 copy of a trained network for self-play on CPU.
+
+quantizeNetwork quantizes the network statically: the convolutions are fused with their batch norms (and the ReLU of
+the first layer), the network is run over stored positions to measure the range of every activation, and every layer
+then runs in int8. With dynamic=True only the fully connected layer is quantized, with its activations measured on
+every call instead, and no positions are needed. The fully connected layer holds most of the weights of the network,
+so that gets much of the speed for none of the calibration.
+
+Quantized modules do not come back whole from torch.save (their submodules are lost on unpickling), so the quantized
+network is traced and saved as TorchScript instead (see ExportNetwork). ChessConvNet.loadNetwork recognizes those
+files, so MCTS, SelfPlayPool and InferenceServer load it from its directory as usual. It takes and returns float32
+states and outputs, and runs on the quantized engine it was made with (torch.backends.quantized.engine).
+"""
+import copy
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao import quantization
+from ChessConvNet import loadNetwork, splitOutputs
+from ChessEnvironment import recordsToStates
+from ExportNetwork import saveScript
+from ReplayBuffer import ReplayBuffer
+
+
+# ChessConvNet with its inputs quantized and its outputs dequantized, as static quantization needs.
+class QuantizedChessConvNet(nn.Module):
+
+    def __init__(self, network):
+        super(QuantizedChessConvNet, self).__init__()
+        self.quant = quantization.QuantStub()
+        self.layer1 = copy.deepcopy(network.layer1)
+        self.layer2 = copy.deepcopy(network.layer2)
+        self.layer3 = copy.deepcopy(network.layer3)
+        self.fc = copy.deepcopy(network.fc)
+        self.valueHead = getattr(network, "valueHead", False)
+        if self.valueHead:
+            self.value = copy.deepcopy(network.value)
+            self.valueDequant = quantization.DeQuantStub()
+        self.dequant = quantization.DeQuantStub()
+
+    def forward(self, x):
+        out = self.quant(x)
+        out = self.layer1(out)
+        out = self.layer2(out)
+        out = self.layer3(out)
+        out = out.reshape(out.size(0), -1)
+        if self.valueHead:
+            return self.dequant(self.fc(out)), self.valueDequant(self.value(out)).reshape(-1)
+        out = self.fc(out)
+        return self.dequant(out)
+
+
+# numberOfPositions positions picked at random from a ReplayBuffer, as float32 states.
+def storedStates(directory, numberOfPositions=2000, seed=0):
+    records = ReplayBuffer(directory).load()[0]
+    if len(records) == 0:
+        raise ValueError("No positions in " + directory)
+    picked = np.random.RandomState(seed).permutation(len(records))[0:numberOfPositions]
+    return recordsToStates(records[np.sort(picked)])
+
+
+# the move array outputs of network in eval mode, run batch by batch.
+def runNetwork(network, states, batchSize=256):
+    outputs = []
+    with torch.inference_mode():
+        for start in range(0, len(states), batchSize):
+            outputs.append(splitOutputs(network(torch.from_numpy(states[start:start + batchSize])))[0].float().numpy())
+    return np.concatenate(outputs)
+
+
+# an int8 copy of network (in eval mode), statically quantized with the activations calibrated on states, or
+# dynamically quantized without them.
+def quantizeNetwork(network, states=None, dynamic=False, engine=None):
+    engine = engine or torch.backends.quantized.engine
+    torch.backends.quantized.engine = engine
+    network = copy.deepcopy(network).float().eval()
+    if dynamic:
+        return quantization.quantize_dynamic(network, {nn.Linear}, dtype=torch.qint8)
+
+    quantized = QuantizedChessConvNet(network).eval()
+    fused = [["layer1.0", "layer1.1", "layer1.2"], ["layer2.0", "layer2.1"], ["layer3.0", "layer3.1"]]
+    if quantized.valueHead:
+        fused.append(["value.0", "value.1"])
+    quantization.fuse_modules(quantized, fused, inplace=True)
+    quantized.qconfig = quantization.get_default_qconfig(engine)
+    quantization.prepare(quantized, inplace=True)
+    runNetwork(quantized, states)
+    quantization.convert(quantized, inplace=True)
+    return quantized
+
+
+# average seconds per forward pass of batches of each size.
+def latency(network, states, batchSizes=(1, 8, 64), repeats=20):
+    times = {}
+    with torch.inference_mode():
+        for batchSize in batchSizes:
+            batch = torch.from_numpy(states[0:batchSize])
+            network(batch)
+            start = time.time()
+            for i in range(repeats):
+                network(batch)
+            times[batchSize] = (time.time() - start) / repeats
+    return times
+
+
+# how far the quantized network drifts from the network on states: how often both put their largest output on the
+# same entry of the move array (top-1 agreement), and the largest and mean difference of the outputs. Also times both.
+def driftReport(network, quantized, states, batchSizes=(1, 8, 64)):
+    network = copy.deepcopy(network).float().eval()
+    outputs = runNetwork(network, states)
+    quantizedOutputs = runNetwork(quantized, states)
+    difference = np.abs(outputs - quantizedOutputs)
+    report = {"positions": len(states),
+              "agreement": float(np.mean(np.argmax(outputs, 1) == np.argmax(quantizedOutputs, 1))),
+              "maxDifference": float(np.max(difference)),
+              "meanDifference": float(np.mean(difference)),
+              "latency": latency(network, states, batchSizes),
+              "quantizedLatency": latency(quantized, states, batchSizes)}
+
+    print("Quantized network on", report["positions"], "positions:")
+    print("  top-1 agreement with float32:", round(100 * report["agreement"], 2), "%")
+    print("  output difference: max", round(report["maxDifference"], 4), "mean", round(report["meanDifference"], 4))
+    for batchSize in batchSizes:
+        before = report["latency"][batchSize] * 1000
+        after = report["quantizedLatency"][batchSize] * 1000
+        print("  batch of", str(batchSize).rjust(3) + ":", round(before, 3), "ms float32,", round(after, 3),
+              "ms int8,", round(before / after, 2), "times faster")
+    return report
+
+
+# quantizes the network saved at directory, calibrated and checked on different positions of the ReplayBuffer at
+# replayDirectory, saves it to saveDirectory and returns the drift report of the saved network.
+def quantizeSavedNetwork(directory, replayDirectory, saveDirectory, dynamic=False, numberOfPositions=2000, seed=0):
+    network = loadNetwork(directory).eval()
+    states = storedStates(replayDirectory, 2 * numberOfPositions, seed)
+    calibration = states[0::2]
+    heldOut = states[1::2]
+    saveScript(quantizeNetwork(network, calibration, dynamic), torch.from_numpy(calibration[0:8]), saveDirectory)
+    return driftReport(network, loadNetwork(saveDirectory), heldOut)
+
+
+if __name__ == "__main__":
+    quantizeSavedNetwork("supervised.pt", "replay", "supervised-int8.pt")
@@ -0,0 +1,99 @@
+"""
+Self-play data on disk, as a directory of chunks that are only ever added to.
+
+A chunk holds the positions of one write (usually one game) as five .npy files:
+    records   uint8 (N, RECORD_LEN)  board records of the positions (see ChessEnvironment.toRecord)
+    offsets   int64 (N + 1)          policy target k is indices/weights[offsets[k]:offsets[k + 1]]
+    indices   int16 (M)              entries of the move array (see ActionToArray.denseActions)
+    weights   float32 (M)
+    values    float32 (N)            share of points won by the side to move
+
+index.jsonl has one line per finished chunk. Every writer names its chunks after itself, writes the files under
+temporary names, renames them and only then appends the line to the index in one write, so any number of processes
+can write to the same directory and readers never see half a chunk. Chunks are read back with np.load(mmap_mode="r"),
+so nothing is copied until it is used.
+"""
+import json
+import os
+import socket
+import uuid
+
+import numpy as np
+from ChessEnvironment import RECORD_LEN
+from PositionAccumulator import PositionAccumulator
+
+CHUNK_ARRAYS = ["records", "offsets", "indices", "weights", "values"]
+
+
+class ReplayBuffer():
+
+    def __init__(self, directory, writer=None):
+        self.directory = directory
+        self.writer = writer or socket.gethostname() + "-" + str(os.getpid())
+        os.makedirs(os.path.join(directory, "chunks"), exist_ok=True)
+
+    def chunkPath(self, chunk, name):
+        return os.path.join(self.directory, "chunks", chunk + "." + name + ".npy")
+
+    # writes one chunk and returns its name.
+    def write(self, records, offsets, indices, weights, values, games=1):
+        chunk = self.writer + "-" + uuid.uuid4().hex[0:12]
+        arrays = [np.asarray(records, dtype=np.uint8), np.asarray(offsets, dtype=np.int64),
+                  np.asarray(indices, dtype=np.int16), np.asarray(weights, dtype=np.float32),
+                  np.asarray(values, dtype=np.float32)]
+        for name, array in zip(CHUNK_ARRAYS, arrays):
+            temporaryPath = self.chunkPath(chunk, name) + ".tmp"
+            with open(temporaryPath, "wb") as file:
+                np.save(file, array)
+            os.replace(temporaryPath, self.chunkPath(chunk, name))
+
+        line = json.dumps({"chunk": chunk, "positions": len(arrays[0]), "entries": len(arrays[2]),
+                           "games": games}) + "\n"
+        index = os.open(os.path.join(self.directory, "index.jsonl"), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(index, line.encode())
+        finally:
+            os.close(index)
+        return chunk
+
+    # writes games as returned by MCTS.simulateTrainingGame as one chunk, each position once.
+    def writeGames(self, games):
+        accumulator = PositionAccumulator()
+        for game in games:
+            accumulator.addGame(*game)
+        offsets, indices, weights = accumulator.sparseActions()
+        return self.write(accumulator.parentRecords(), offsets, indices, weights,
+                          accumulator.values(), games=len(games))
+
+    # the lines of the index, in the order the chunks were finished.
+    def chunks(self):
+        try:
+            with open(os.path.join(self.directory, "index.jsonl")) as file:
+                return [json.loads(line) for line in file if line.endswith("\n")]
+        except FileNotFoundError:
+            return []
+
+    def __len__(self):
+        return sum(chunk["positions"] for chunk in self.chunks())
+
+    # the arrays of a chunk by name, memory mapped unless mmap is False.
+    def readChunk(self, chunk, mmap=True):
+        return {name: np.load(self.chunkPath(chunk, name), mmap_mode="r" if mmap else None)
+                for name in CHUNK_ARRAYS}
+
+    # all the chunks in memory as one set of arrays, with the offsets running over all of them.
+    def load(self):
+        chunks = [self.readChunk(chunk["chunk"]) for chunk in self.chunks()]
+        if len(chunks) == 0:
+            return (np.zeros((0, RECORD_LEN), dtype=np.uint8), np.zeros(1, dtype=np.int64),
+                    np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32))
+        offsets = [np.zeros(1, dtype=np.int64)]
+        entries = 0
+        for chunk in chunks:
+            offsets.append(chunk["offsets"][1:] + entries)
+            entries += chunk["offsets"][-1]
+        return (np.concatenate([chunk["records"] for chunk in chunks]), np.concatenate(offsets),
+                np.concatenate([chunk["indices"] for chunk in chunks]),
+                np.concatenate([chunk["weights"] for chunk in chunks]),
+                np.concatenate([chunk["values"] for chunk in chunks]))
+
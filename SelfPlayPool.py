@@ -0,0 +1,104 @@
+"""
+Self-play with several processes. Each worker process has its own MCTS and its own copy of the network, and plays
+whole games with simulateTrainingGame. Given an InferenceServer, the workers send their positions to its network
+instead. Finished games are streamed back to the main process as they come in.
+
+Every game starts from an empty tree, and its random numbers are seeded from the seed of the pool and the number of
+the game, so a game comes out the same no matter which worker plays it or how many workers there are.
+"""
+import multiprocessing
+import random
+import time
+
+import numpy as np
+import torch
+from MCTSCrazyhouse import MCTS, trainingDataFromGames
+
+# the MCTS and settings of a worker process, set by initWorker.
+treeSearch = None
+workerSettings = None
+
+
+# searchOptions are keyword arguments of the MCTS. clients are the InferenceClients of a server, if there is one.
+# Each worker takes the next one, counted by nextClient.
+def initWorker(directory, network, playouts, batchSize, seed, reuseTree, searchOptions, clients=None,
+               nextClient=None):
+    global treeSearch, workerSettings
+    # one thread per process, the processes already use all the cores.
+    torch.set_num_threads(1)
+    if clients is not None:
+        with nextClient.get_lock():
+            network = clients[nextClient.value]
+            nextClient.value += 1
+    treeSearch = MCTS(directory, network, **searchOptions)
+    workerSettings = (playouts, batchSize, seed, reuseTree)
+
+
+def seedGame(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def playGame(gameNumber):
+    playouts, batchSize, seed, reuseTree = workerSettings
+    seedGame(seed + gameNumber)
+    treeSearch.seedSearch(seed + gameNumber)
+    treeSearch.resetTree()
+    game = treeSearch.simulateTrainingGame(playouts, round=str(gameNumber + 1), batchSize=batchSize,
+                                           printPGN=False, reuseTree=reuseTree)
+    return gameNumber, game
+
+
+class SelfPlayPool():
+
+    # directory is the saved network, as for MCTS. network, when given, is sent to the workers instead.
+    # server is a started InferenceServer with a slot for every worker. reuseTree is passed on to
+    # simulateTrainingGame, and maxNodes, eviction, leafEvaluation, dirichletAlpha and dirichletFraction to the MCTS
+    # of every worker.
+    def __init__(self, directory, workers=None, playouts=1, batchSize=1, seed=0, network=None, server=None,
+                 reuseTree=False, maxNodes=None, eviction="lru", leafEvaluation=False, dirichletAlpha=None,
+                 dirichletFraction=0.25):
+        self.directory = directory
+        self.network = network
+        self.server = server
+        self.workers = workers or multiprocessing.cpu_count()
+        self.playouts = playouts
+        self.batchSize = batchSize
+        self.seed = seed
+        self.reuseTree = reuseTree
+        self.searchOptions = {"maxNodes": maxNodes, "eviction": eviction, "leafEvaluation": leafEvaluation,
+                              "dirichletAlpha": dirichletAlpha, "dirichletFraction": dirichletFraction}
+
+    # yields (game number, game) for each game in the order they finish. A game is what simulateTrainingGame
+    # returns.
+    def games(self, numberOfGames, firstGame=0):
+        initargs = (self.directory, self.network, self.playouts, self.batchSize, self.seed, self.reuseTree,
+                    self.searchOptions)
+        if self.server is not None:
+            initargs = initargs + (self.server.clients(), multiprocessing.Value("i", 0))
+        pool = multiprocessing.Pool(self.workers, initializer=initWorker, initargs=initargs)
+        try:
+            for gameNumber, game in pool.imap_unordered(playGame, range(firstGame, firstGame + numberOfGames)):
+                yield gameNumber, game
+        finally:
+            pool.terminate()
+            pool.join()
+
+    # writes every game into the ReplayBuffer as soon as it finishes, one chunk per game.
+    def saveGames(self, numberOfGames, replayBuffer, firstGame=0):
+        for gameNumber, game in self.games(numberOfGames, firstGame):
+            replayBuffer.writeGames([game])
+            print("Game", gameNumber + 1, "saved,", len(game[0]), "positions.")
+
+    # same output as MCTS.createTrainingGames, with the games merged in the order of their numbers.
+    def createTrainingGames(self, numberOfGames, firstGame=0):
+        start = time.time()
+        games = [None] * numberOfGames
+        for gameNumber, game in self.games(numberOfGames, firstGame):
+            games[gameNumber - firstGame] = game
+            print("Game", gameNumber + 1, "finished,", len(game[0]), "positions.")
+        elapsed = time.time() - start
+        print(numberOfGames, "games in", round(elapsed, 1), "seconds with", self.workers, "workers,",
+              round(numberOfGames * 3600 / elapsed, 1), "games/hour.")
+        return trainingDataFromGames(games)
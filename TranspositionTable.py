@@ -0,0 +1,70 @@
+import numpy as np
+
+
+# Maps position hashes (ChessEnvironment.zobristHash) to node indices of the MCTS. It is an open-addressing table
+# with linear probing: keys and values live in two flat numpy arrays, so each position costs 16 bytes per slot
+# instead of a dictionary entry holding a long string. The table doubles in size when it is half full.
+class TranspositionTable():
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.keys = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full(capacity, -1, dtype=np.int64)  # -1 marks an empty slot
+        self.mask = capacity - 1
+
+    # slot holding the key, or the empty slot where it would be inserted.
+    def findSlot(self, key):
+        keys, values, mask = self.keys, self.values, self.mask
+        slot = key & mask
+        while values[slot] != -1 and keys[slot] != key:
+            slot = (slot + 1) & mask
+        return slot
+
+    def get(self, key, default=None):
+        value = self.values[self.findSlot(key)]
+        if value == -1:
+            return default
+        return int(value)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.values[self.findSlot(key)] != -1
+
+    def __setitem__(self, key, value):
+        slot = self.findSlot(key)
+        if self.values[slot] == -1:
+            if (self.size + 1) * 2 > len(self.keys):
+                self.resize(len(self.keys) * 2)
+                slot = self.findSlot(key)
+            self.keys[slot] = key
+            self.size += 1
+        self.values[slot] = value
+
+    def __len__(self):
+        return self.size
+
+    def items(self):
+        occupied = np.nonzero(self.values != -1)[0]
+        return zip(self.keys[occupied].tolist(), self.values[occupied].tolist())
+
+    def resize(self, capacity):
+        oldItems = list(self.items())
+        self.allocate(capacity)
+        for key, value in oldItems:
+            slot = self.findSlot(key)
+            self.keys[slot] = key
+            self.values[slot] = value
+
+    def memoryUsage(self):
+        return self.keys.nbytes + self.values.nbytes
+
+    def __repr__(self):
+        return "TranspositionTable(" + str(dict(self.items())) + ")"